@@ -1,16 +1,18 @@
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import load.manage_db as manage_db
 
 class PercentChange:
+    # NAICS Codes of the clothing store categories
+    categories = {"mens_clothing": "44811", "womens_clothing": "44812", "all_clothing": "4481"}
 
     def __init__(self):
         self.df = None
 
 
     def setup(self):
-        self.df = manage_db.read_percent_change()
+        # Filter by NAICS Codes
+        self.df = manage_db.read_series(self.categories, end="2020-01-01")
         # Check for missing values
         sum_nans = self.df.isna().sum()        
         if sum_nans.sum() == 0:
@@ -40,8 +42,8 @@ class PercentChange:
     # Get Annual Sales Percent of Change
     def get_annual_poc(self):
         print("Processing: Annual Sales Percent of Change")
-        # Group by year while settting index, calculate percent of change
-        df_annual_PoC = self.df.groupby(pd.Grouper(key='sales_date', freq='Y')).sum().pct_change()
+        # Read the annual totals while settting index, calculate percent of change
+        df_annual_PoC = manage_db.read_annual_series(self.categories, end="2020-01-01").pct_change()
         # Setup annual plot
         fig, ax = plt.subplots()
         ax.plot(df_annual_PoC.index, df_annual_PoC["mens_clothing"], label="Men's")
@@ -73,8 +75,8 @@ class PercentChange:
     # Get Annual Sales Percent of Whole
     def get_annual_pow(self):
         print("Processing: Annual Sales Percent of Whole")
-        # Group by year while settting index
-        df_annual_PoW = self.df.groupby(pd.Grouper(key='sales_date', freq='Y')).sum()
+        # Read the annual totals while settting index
+        df_annual_PoW = manage_db.read_annual_series(self.categories, end="2020-01-01")
         # Calculate percent of whole
         df_annual_PoW["mens_clothing"] = np.divide(df_annual_PoW['mens_clothing'], df_annual_PoW['all_clothing'])
         df_annual_PoW["womens_clothing"] = np.divide(df_annual_PoW['womens_clothing'], df_annual_PoW['all_clothing'])
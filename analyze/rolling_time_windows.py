@@ -1,16 +1,18 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 from statsmodels.tsa.seasonal import seasonal_decompose
 
 import load.manage_db as manage_db
 
 class RollingTimeWindow:
+    # NAICS Codes of the new and used car dealer categories
+    categories = {"new_cars": "44111", "used_cars": "44112"}
 
     def __init__(self):
         self.df = None
 
     def setup(self):
-        self.df = manage_db.read_rolling_time()
+        # Filter by NAICS Codes
+        self.df = manage_db.read_series(self.categories)
         # Check for missing values
         sum_nans = self.df.isna().sum()        
         if sum_nans.sum() == 0:
@@ -56,9 +58,10 @@ class RollingTimeWindow:
     # Monthly Sales 12MA
     def get_monthly_12ma(self):
         print("Processing: Monthly Sales 12MA")
-        df_rolling = self.df.copy(deep=True)
-        df_rolling["new_cars"] = self.df["new_cars"].rolling(12).mean()
-        df_rolling["used_cars"] = self.df["used_cars"].rolling(12).mean()
+        # Read the 12 month trailing sums, averaged over their 12 months. Unlike a rolling mean of the
+        # interpolated monthly sales, a window with a missing month has no average (the stored months are summed)
+        df_rolling = manage_db.read_series(self.categories, freq="12M")
+        df_rolling[["new_cars", "used_cars"]] = df_rolling[["new_cars", "used_cars"]] / 12
         # Drop missing values caused by 12 month rolling average
         df_rolling.dropna(inplace=True)
         # Setup monthly with 12 month MA plot  
@@ -1,16 +1,18 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 
 import load.manage_db as manage_db
 
 
 class TrendComparisons:
+    # NAICS Codes of the sporting goods, hobby and book store categories
+    categories = {"sport_sales": "45111", "hobby_sales": "45112", "book_sales": "451211"}
 
     def __init__(self):
         self.df = None
 
     def setup(self):
-        self.df = manage_db.read_trends()
+        # Filter by NAICS Codes
+        self.df = manage_db.read_series(self.categories)
         # Check for missing values
         sum_nans = self.df.isna().sum()        
         if sum_nans.sum() == 0:
@@ -39,8 +41,8 @@ class TrendComparisons:
     # Annual Sales
     def get_annual_trends(self):
         print("Processing: Annual Sales")
-        # Group by year
-        df_annual = self.df.groupby(pd.Grouper(key='sales_date', freq='Y')).sum()
+        # Read the annual totals
+        df_annual = manage_db.read_annual_series(self.categories)
         # Setup annual plot
         fig, ax = plt.subplots()
         ax.plot(df_annual.index, df_annual["sport_sales"], label="Sports")
@@ -1,10 +1,10 @@
-
-import pandas as pd
 import matplotlib.pyplot as plt
 from statsmodels.tsa.seasonal import seasonal_decompose
 import load.manage_db as manage_db
 
 class Trends:
+    # Kind of Business of the combined sales
+    categories = {"sales": "Retail and food services sales, total"}
 
     def __init__(self):
         self.df = None
@@ -12,7 +12,9 @@ class Trends:
 
     def setup_df(self):
         # Create DataFrame and interpolate any possible missing values
-        self.df = manage_db.read_combined_sales()
+        # Do not combine by year. Doing so may hide months with empty sales that should be interpolated
+        # Filter by Kind of Business
+        self.df = manage_db.read_series(self.categories, table_name="combined_sales")
         # Check for missing values
         sum_nans = self.df.isna().sum()        
         if sum_nans.sum() == 0:
@@ -38,8 +40,8 @@ class Trends:
     # Get Annual Sales
     def get_annual(self):
         print("Processing: Annual Sales")
-        # Group by year
-        df_annual = self.df.groupby(pd.Grouper(key='sales_date', freq='Y')).sum() 
+        # Read the annual totals
+        df_annual = manage_db.read_annual_series(self.categories, table_name="combined_sales")
         fig, ax = plt.subplots()
         ax.plot(df_annual.index, df_annual["sales"])
         plt.gca().set(title="Annual Retail and Food Services Sales", xlabel="Years", ylabel="Sales")
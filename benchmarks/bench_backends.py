@@ -0,0 +1,61 @@
+# Benchmark of the validation and analyze queries on each storage backend in load.storage
+# (MYSQL needs the server in load/db.yaml and is skipped when it cannot be reached, DuckDB needs pip install duckdb)
+# Run from the project root: python -m benchmarks.bench_backends
+# Warning: reloads the combined_sales and store_sales tables of each backend from the workbook
+from time import perf_counter
+
+import transform.clean as clean
+import load.manage_db as manage_db
+import load.storage as storage
+
+REPEAT = 5
+
+
+def best_of(query):
+    best = None
+    for _ in range(REPEAT):
+        start_time = perf_counter()
+        query()
+        elapsed = perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def time_backend(backend, df_all_sales):
+    backend.create_db()
+    backend.create_tables()
+    backend.empty_tables()
+    backend.insert_sales(df_all_sales['df_combined'], 'combined_sales')
+    backend.insert_sales(df_all_sales['df_store'], 'store_sales')
+    results = {'refresh_summaries': best_of(backend.refresh_summaries),
+               'calc_annual_sales': best_of(backend.calc_annual_sales)}
+    for reader, (table_name, cat_codes, start, end) in manage_db.explain_series.items():
+        results[reader] = best_of(lambda: backend.read_series(table_name, list(cat_codes.values()), start, end))
+        results[f"{reader} (Y)"] = best_of(lambda: backend.read_series(table_name, list(cat_codes.values()), start, end, "Y"))
+    return results
+
+
+def main():
+    df_all_sales = clean.Clean().get_all_sales()
+    backends = {}
+    if storage.duckdb is not None:
+        backends['duckdb'] = storage.DuckDBStorage()
+    backends['mysql'] = storage.MySQLStorage()
+
+    results = {}
+    for name, backend in backends.items():
+        try:
+            results[name] = time_backend(backend, df_all_sales)
+        except Exception as e:
+            print(f"---- Warning: {name} backend skipped ->\n", e)
+        finally:
+            backend.close()
+
+    print(f"Completed: timed the validation and analyze queries on each backend (best of {REPEAT})")
+    for query in next(iter(results.values()), {}):
+        print(f"\t{query.ljust(24)} " + ", ".join(f"{name}: {round(result[query],4)} seconds" for name, result in results.items()) +
+              (f" (duckdb {round(results['mysql'][query]/results['duckdb'][query],1)}x faster)" if len(results) == 2 else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# Benchmark of the analyze readers with and without the result cache in load.result_cache
+# (needs the backend in load/db.yaml loaded by -etl, and pyarrow)
+# Run from the project root: python -m benchmarks.bench_cache
+# Warning: clears the result cache
+import shutil
+from time import perf_counter
+
+import load.manage_db as manage_db
+import load.result_cache as result_cache
+
+REPEAT = 5
+
+
+def time_readers():
+    start_time = perf_counter()
+    for reader, (table_name, cat_codes, start, end) in manage_db.explain_series.items():
+        for freq in manage_db.FREQS:
+            manage_db.read_series(cat_codes, start, end, freq, table_name)
+    return perf_counter() - start_time
+
+
+def main():
+    if not result_cache.is_enabled() or not manage_db.get_data_version():
+        print("---- Error: the result cache needs pyarrow, result_cache_max_mb above 0 and a database loaded by -etl")
+        return
+    shutil.rmtree(result_cache.get_cache_dir(), ignore_errors=True)
+    # The first pass queries the database and fills the cache, the others only read the cached files
+    uncached = time_readers()
+    cached = min(time_readers() for _ in range(REPEAT))
+    print(f"Completed: timed {len(manage_db.explain_series) * len(manage_db.FREQS)} analyze reads (cached: best of {REPEAT})")
+    print(f"\tdatabase: {round(uncached,4)} seconds, cached: {round(cached,4)} seconds ({round(uncached/cached,1)}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Benchmark of the analyze reader queries before and after the natural key migration in load.manage_db
+# (needs the MYSQL server in load/db.yaml)
+# Run from the project root: python -m benchmarks.bench_indexes
+# Warning: drops the tables, then reloads them (with the current schema) from the workbook
+from time import perf_counter
+
+import transform.clean as clean
+import load.manage_db as manage_db
+import load.storage as storage
+
+REPEAT = 5
+
+# Tables as they were created before the natural keys
+legacy_tables = ["""CREATE TABLE combined_sales(
+        id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        sales_date DATE NOT NULL,
+        sales INT,
+        cat_name VARCHAR(500) NOT NULL,
+        CONSTRAINT uc_combined_sales UNIQUE (sales_date, sales, cat_name))
+        ENGINE=InnoDB;""",
+    """CREATE TABLE store_sales (
+        id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        sales_date DATE NOT NULL,
+        sales INT,
+        cat_name VARCHAR(500) NOT NULL,
+        cat_code VARCHAR(50) NOT NULL,
+        CONSTRAINT uc_sales UNIQUE (sales_date, sales, cat_name, cat_code))
+        ENGINE=InnoDB;"""]
+
+# Reader queries as they were before (no cat_code filter, NAICS codes passed as numbers)
+legacy_queries = {
+    'read_combined_sales': ("""SELECT sales_date, CAST(sales AS UNSIGNED) FROM combined_sales WHERE cat_name = %s;""",
+                            ("Retail and food services sales, total",)),
+    'read_percent_change': ("""SELECT sales_date,
+                                   MAX(CASE WHEN cat_code=%s THEN sales END) as mens_clothing,
+                                   MAX(CASE WHEN cat_code=%s THEN sales END) as womens_clothing,
+                                   MAX(CASE WHEN cat_code=%s THEN sales END) as all_clothing
+                               FROM store_sales WHERE sales_date < '2020-01-01' GROUP BY 1;""", (44811, 44812, 4481)),
+    'read_rolling_time': ("""SELECT sales_date,
+                                 MAX(CASE WHEN cat_code=%s THEN sales END) as new_cars,
+                                 MAX(CASE WHEN cat_code=%s THEN sales END) as used_cars
+                             FROM store_sales GROUP BY 1;""", (44111, 44112)),
+    'read_trends': ("""SELECT sales_date,
+                           MAX(CASE WHEN cat_code=%s THEN sales END) as sport_sales,
+                           MAX(CASE WHEN cat_code=%s THEN sales END) as hobby_sales,
+                           MAX(CASE WHEN cat_code=%s THEN sales END) as book_sales
+                       FROM store_sales GROUP BY 1;""", (45111, 45112, 451211))
+}
+
+# The same readers through manage_db.read_series (table, categories, start, end)
+reader_series = {
+    'read_combined_sales': ('combined_sales', ["Retail and food services sales, total"], None, None),
+    'read_percent_change': ('store_sales', ['44811', '44812', '4481'], None, '2020-01-01'),
+    'read_rolling_time': ('store_sales', ['44111', '44112'], None, None),
+    'read_trends': ('store_sales', ['45111', '45112', '451211'], None, None)
+}
+
+
+def time_queries(queries):
+    results = {}
+    with storage.get_storage().get_cursor() as cursor:
+        for reader, (query, params) in queries.items():
+            best = None
+            for _ in range(REPEAT):
+                start_time = perf_counter()
+                cursor.execute(query, params)
+                cursor.fetchall()
+                elapsed = perf_counter() - start_time
+                best = elapsed if best is None else min(best, elapsed)
+            results[reader] = best
+    return results
+
+
+def main():
+    storage.get_storage("mysql")
+    df_all_sales = clean.Clean().get_all_sales()
+    manage_db.create_db()
+    manage_db.drop_tables()
+    with storage.get_storage().get_cursor() as cursor:
+        for create_table in legacy_tables:
+            cursor.execute(create_table)
+    manage_db.insert_combined_sales(df_all_sales['df_combined'])
+    manage_db.insert_store_sales(df_all_sales['df_store'])
+    legacy = time_queries(legacy_queries)
+
+    # Migrates the legacy tables to the natural keys
+    manage_db.create_tables()
+    manage_db.explain_readers()
+    keyed = time_queries({reader: storage.get_storage().get_series_query(table_name, cat_codes, start, end)
+                          for reader, (table_name, cat_codes, start, end) in reader_series.items()})
+
+    print(f"Completed: timed the analyze reader queries (best of {REPEAT})")
+    for reader in legacy:
+        print(f"\t{reader.ljust(20)} legacy: {round(legacy[reader],4)} seconds, " +
+              f"natural key: {round(keyed[reader],4)} seconds ({round(legacy[reader]/keyed[reader],1)}x faster)")
+
+
+if __name__ == "__main__":
+    main()
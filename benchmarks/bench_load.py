@@ -0,0 +1,49 @@
+# Throughput benchmark of the load methods in load.manage_db (needs the MYSQL server in load/db.yaml)
+# Run from the project root: python -m benchmarks.bench_load
+# Warning: empties the combined_sales and store_sales tables
+from time import perf_counter
+
+import transform.clean as clean
+import load.manage_db as manage_db
+import load.storage as storage
+
+REPEAT = 3
+METHODS = ["to_sql", "executemany", "infile", "concurrent"]
+
+
+def time_method(method, df_all_sales):
+    best = None
+    for _ in range(REPEAT):
+        manage_db.empty_tables()
+        start_time = perf_counter()
+        if method == "concurrent":
+            # load_method from load/db.yaml, with both tables and the store_sales years written at the same time
+            manage_db.insert_sales_concurrently(df_all_sales)
+        else:
+            manage_db.insert_sales(df_all_sales['df_combined'], 'combined_sales', method)
+            manage_db.insert_sales(df_all_sales['df_store'], 'store_sales', method)
+        elapsed = perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    # The load methods are MYSQL's
+    storage.get_storage("mysql")
+    manage_db.create_db()
+    manage_db.create_tables()
+    df_all_sales = clean.Clean().get_all_sales()
+    record_count = df_all_sales['df_combined'].shape[0] + df_all_sales['df_store'].shape[0]
+
+    results = {method: time_method(method, df_all_sales) for method in METHODS}
+    # Leave the tables as a normal load would
+    manage_db.empty_tables()
+
+    print(f"Completed: loaded {'{:,}'.format(record_count)} records with each method (best of {REPEAT})")
+    for method, elapsed in results.items():
+        print(f"\t{method.ljust(12)} {round(elapsed,4)} seconds, {'{:,}'.format(int(record_count/elapsed))} records/second" +
+              f" ({round(results['to_sql']/elapsed,1)}x to_sql)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Micro-benchmark of the per-sheet wide-to-long reshaping in extract.get_sales_df
+# Run from the project root: python -m benchmarks.bench_reshape
+from datetime import datetime
+from time import perf_counter
+import pandas as pd
+import numpy as np
+
+from extract.get_sales_df import GetSalesDF
+
+REPEAT = 5
+
+
+# Row-by-row reshaping that get_store_df used before it was vectorized
+def legacy_store_df(get_sales, df_raw, cur_year):
+    df_store_unf = df_raw.iloc[12:71, 0:14]
+    df_store_unf.columns = get_sales.col_names
+    df_store = pd.DataFrame(columns=["sales_date", "sales", "cat_code", "cat_name"])
+    df_store["sales"] = df_store_unf.iloc[:,2:15].stack().dropna()
+    for row in range(12,70):
+        df_store.loc[row, "cat_code"] = f"{df_store_unf.cat_code.loc[row]}"
+        df_store.loc[row, "cat_name"] = df_store_unf.cat_name.loc[row]
+        for month in range(1,13):
+            df_store.loc[(row, f"{month}"), "sales_date"] = datetime.strptime(f"{cur_year}-{month}-1", '%Y-%m-%d').date()
+    df_store = df_store.droplevel(0)
+    df_store["sales"] = df_store["sales"].replace(to_replace=["(NA)","(S)"], value=np.nan)
+    # Dates are now stored as datetime64
+    df_store["sales_date"] = pd.to_datetime(df_store["sales_date"])
+    return df_store
+
+
+def time_reshaper(reshaper, raw_sheets):
+    best = None
+    for _ in range(REPEAT):
+        start_time = perf_counter()
+        for cur_year, df_raw in raw_sheets.items():
+            reshaper(df_raw, cur_year)
+        elapsed = perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    get_sales = GetSalesDF(None)
+    raw_sheets = get_sales.get_raw_sheets()
+
+    # Both reshapers must produce the same frames
+    for cur_year, df_raw in raw_sheets.items():
+        pd.testing.assert_frame_equal(legacy_store_df(get_sales, df_raw, cur_year),
+                                      get_sales.get_store_df(df_raw, cur_year), check_dtype=False)
+
+    legacy = time_reshaper(lambda df_raw, cur_year: legacy_store_df(get_sales, df_raw, cur_year), raw_sheets)
+    vectorized = time_reshaper(get_sales.get_store_df, raw_sheets)
+    print(f"Completed: reshaped {len(raw_sheets)} store sheets (best of {REPEAT})")
+    print(f"\tlegacy loop: {round(legacy,4)} seconds")
+    print(f"\tvectorized:  {round(vectorized,4)} seconds ({round(legacy/vectorized,1)}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,9 @@ import sys
 from time import perf_counter
 
 import transform.clean as clean
+import transform.interpolate as interpolate
 import load.manage_db as manage_db
+import load.storage as storage
 import load.validation as validation
 from analyze.trends import Trends
 from analyze.percent_change import PercentChange
@@ -17,18 +19,63 @@ getSalesDF = None
 if len(sys.argv) > 1:
     # Prevent other scripts with CLAs from being called
     filename = os.path.basename(sys.argv[0])
-    if filename == 'control.py':
+    # Extract worker processes re-import this module, so only run commands from the main process
+    if filename == 'control.py' and __name__ == '__main__':
+
+        # Number of processes used to extract the workbook sheets, e.g. "-etl --workers 8"
+        workers = 1
+        if "--workers" in sys.argv:
+            try:
+                workers = int(sys.argv[sys.argv.index("--workers") + 1])
+                if workers < 1:
+                    raise ValueError
+            except (IndexError, ValueError):
+                print("---- Error: --workers must be followed by a positive whole number")
+                sys.exit(1)
+        # Method used to fill store sales nans, e.g. "-etl --interpolation seasonal"
+        interpolation = "linear"
+        if "--interpolation" in sys.argv:
+            try:
+                interpolation = sys.argv[sys.argv.index("--interpolation") + 1]
+            except IndexError:
+                interpolation = None
+            if interpolation not in interpolate.METHODS:
+                print(f"---- Error: --interpolation must be followed by one of: {', '.join(interpolate.METHODS)}")
+                sys.exit(1)
+        # Storage backend of every database command, e.g. "-etl --backend duckdb" (default: backend in load/db.yaml)
+        if "--backend" in sys.argv:
+            try:
+                backend = sys.argv[sys.argv.index("--backend") + 1]
+            except IndexError:
+                backend = None
+            if backend not in storage.BACKENDS:
+                print(f"---- Error: --backend must be followed by one of: {', '.join(storage.BACKENDS)}")
+                sys.exit(1)
+            storage.get_storage(backend)
+        # Ignore saved snapshots and extract from the workbook again, e.g. "-etl --rebuild"
+        rebuild = "--rebuild" in sys.argv
+        # Only load sheets that are new or changed since the last load, e.g. "-etl --incremental"
+        incremental = "--incremental" in sys.argv
+        # Load each year while the next one is extracted and cleaned, e.g. "-etl --stream"
+        stream = "--stream" in sys.argv
 
         # Call relevant functions based on CLA
         argument = sys.argv[1]
         if argument == "-etl":
             start_time = perf_counter()
-            manage_db.insert_all_sales()
+            if incremental:
+                manage_db.insert_new_sales(workers, rebuild, interpolation)
+            elif stream:
+                manage_db.insert_all_sales_streaming(interpolation=interpolation)
+            else:
+                manage_db.insert_all_sales(workers, rebuild, interpolation)
             print(f"Completed: ETL of MRTS dataset in ", round(perf_counter()-start_time,4), " seconds.")  
             sys.exit(0)
         elif argument == "-clean":
-            clean.Clean().get_combined_sales()
-            clean.Clean().get_cleaned_store_sales()
+            # Both frames come from the same extraction session, so the workbook is parsed once
+            cleaner = clean.Clean(workers, rebuild, interpolation)
+            cleaner.get_combined_sales()
+            cleaner.get_cleaned_store_sales()
             sys.exit(0)
         elif argument == "-drop_db":
             manage_db.drop_db()
@@ -39,8 +86,17 @@ if len(sys.argv) > 1:
         elif argument == "-empty_tables":
             manage_db.empty_tables()
             sys.exit(0)
+        elif argument == "-explain":
+            manage_db.explain_readers()
+            sys.exit(0)
+        elif argument == "-export":
+            # Streamed in batches, so the whole table is never held in memory
+            for table_name in storage.sales_tables:
+                manage_db.export_sales(table_name, f"./exports/{table_name}.csv")
+            sys.exit(0)
         elif argument == "-validate":
-            df_all_sales = clean.Clean().get_all_sales()
+            # validate_all reuses the extraction session of this Clean
+            df_all_sales = clean.Clean(workers, rebuild, interpolation).get_all_sales()
             validation.validate_all(df_all_sales)
             sys.exit(0)
         elif argument == "-analyze_trends":
@@ -57,7 +113,13 @@ if len(sys.argv) > 1:
             sys.exit(0)
         else:
             print("""---- Error: Argument not recognized please use one of the following:
-                -etl, -clean, -drop_db, -drop_tables, -empty_tables, -validate,
+                -etl, -clean, -drop_db, -drop_tables, -empty_tables, -validate, -explain, -export,
                 -analyze_trends, -analyze_trend_comparisons, -analyze_percent, 
-                -analyze_rolling""")
+                -analyze_rolling
+                Optional: --workers N (extract sheets with N processes for -etl, -clean and -validate)
+                Optional: --rebuild (ignore saved snapshots for -etl, -clean and -validate)
+                Optional: --incremental (only load new or changed sheets for -etl)
+                Optional: --stream (load each year while the next is extracted for -etl)
+                Optional: --interpolation linear|time|seasonal (fill store sales nans for -etl, -clean and -validate)
+                Optional: --backend mysql|duckdb (storage backend of the database commands)""")
 
@@ -1,18 +1,26 @@
+import re
+import hashlib
 import pandas as pd
 import numpy as np
-from datetime import datetime
 from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+import extract.workbook_cache as workbook_cache
+from extract.schema import apply_schema, COMBINED_SCHEMA, STORE_SCHEMA, ANNUAL_SCHEMA
 
 class GetSalesDF:
-    def __init__(self, load_type):
+    def __init__(self, load_type, workers=1):
 
-        self.cur_year = None
-        self.df_raw = pd.DataFrame()
         self.df_totals = pd.DataFrame()
         self.df_combined_sales = pd.DataFrame()
         self.df_store_sales = pd.DataFrame()
+        # Raw Excel sheets by year, parsed once per workbook
+        self.raw_sheets = None
         # Unformated Excel columns   
         self.col_names = ["cat_code", "cat_name", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12"]
+        # Local copy of the census.gov workbook (downloaded once, then served from cache)
+        self.workbook = None
+        # Number of processes used to extract sheets in get_all_sales_df
+        self.workers = workers
 
         if load_type == "combined_sales":
             self.load_combined_sales_df()
@@ -22,54 +30,160 @@ class GetSalesDF:
             self.load_total_df()
 
 
+    def get_workbook(self):
+        if self.workbook is None:
+            self.workbook = workbook_cache.get_workbook()
+        return self.workbook
+
+
+    # Parse all yearly sheets while the workbook is opened only once.
+    # Each sheet's year is read from its month headers (see get_sheet_year). Raises ValueError.
+    def get_raw_sheets(self):
+        if self.raw_sheets is None:
+            start_time = perf_counter()
+            print("Processing: parsing workbook sheets")
+            raw_sheets = {}
+            prev_year = None
+            with pd.ExcelFile(self.get_workbook()) as workbook:
+                # Skip over the first sheet, which is the year in progress
+                for sheet_num in range(1, 30):
+                    df_raw = workbook.parse(sheet_name=sheet_num)
+                    cur_year = get_sheet_year(df_raw, self.get_workbook(), sheet_num)
+                    check_year_order(prev_year, cur_year, self.get_workbook())
+                    prev_year = cur_year
+                    raw_sheets[cur_year] = df_raw
+            self.raw_sheets = raw_sheets
+            print(f"Completed: parsed {len(self.raw_sheets)} workbook sheets in ", round(perf_counter()-start_time,4), " seconds.")
+        return self.raw_sheets
+
+
     # Load all sales dataframes
     def get_all_sales_df(self):
-        # Skip over FY2022, which is in progress. Dataset will be based on 1992 - 2021
-        for sheet_num in range(1, 30):
-            self.cur_year = 2022 - sheet_num
-            # Access Excel sheet from Census.gov website
-            self.df_raw = pd.read_excel("https://www.census.gov/retail/mrts/www/mrtssales92-present.xls", sheet_name=sheet_num)
+        # Collect each sheet's frames, then concatenate once (appending per sheet copies every earlier sheet)
+        combined_chunks = []
+        store_chunks = []
+        totals_chunks = []
+        sheet_hashes = []
+        for cur_year, df_combined, df_store, df_totals, sheet_hash in self.convert_all_sheets():
             # Get converted combined sales
-            self.df_combined_sales = self.df_combined_sales.append(self.get_combined_df())
+            combined_chunks.append(df_combined)
             # Get converted store sales
-            self.df_store_sales = self.df_store_sales.append(self.get_store_df())
+            store_chunks.append(df_store)
+            # Get annual sales
+            totals_chunks.append(df_totals)
+            # Track each sheet's contents, so later loads can skip unchanged sheets
+            sheet_hashes.append({'year': cur_year, 'content_hash': sheet_hash})
+        # Apply the compact schema after concatenating, so categories cover every year
+        self.df_combined_sales = apply_schema(pd.concat(combined_chunks), COMBINED_SCHEMA)
+        self.df_store_sales = apply_schema(pd.concat(store_chunks), STORE_SCHEMA)
+        # Census.gov does not calculate totals for any categories with missing monthly values
+        # So, drop those rows from the df
+        self.df_totals = apply_schema(pd.concat(totals_chunks).dropna(subset=['annual_sales']), ANNUAL_SCHEMA)
         
-        return {'df_combined':self.df_combined_sales, 'df_store':self.df_store_sales, 'df_annual': self.get_totals_df()}
+        return {'df_combined':self.df_combined_sales, 'df_store':self.df_store_sales, 
+                'df_annual': self.df_totals, 'df_sheets': pd.DataFrame(sheet_hashes)}
+
+
+    # One frame of get_all_sales_df, derived on its own from the parsed sheets
+    def get_sales_frame(self, name):
+        raw_sheets = self.get_raw_sheets()
+        if name == 'df_combined':
+            return apply_schema(pd.concat([self.get_combined_df(df_raw, cur_year) for cur_year, df_raw in raw_sheets.items()]),
+                                COMBINED_SCHEMA)
+        if name == 'df_store':
+            return apply_schema(pd.concat([self.get_store_df(df_raw, cur_year) for cur_year, df_raw in raw_sheets.items()]),
+                                STORE_SCHEMA)
+        if name == 'df_annual':
+            return apply_schema(pd.concat([self.get_totals_df(df_raw, cur_year) for cur_year, df_raw in raw_sheets.items()])
+                                .dropna(subset=['annual_sales']), ANNUAL_SCHEMA)
+        return pd.DataFrame([{'year': cur_year, 'content_hash': get_sheet_hash(df_raw)} for cur_year, df_raw in raw_sheets.items()])
+
+
+    # Convert every yearly sheet into its combined, store and annual frames (in year order)
+    def convert_all_sheets(self):
+        # Sheets already parsed in this process are converted here rather than parsed again by workers
+        if self.workers > 1 and self.raw_sheets is None:
+            start_time = perf_counter()
+            print(f"Processing: extracting workbook sheets with {self.workers} workers")
+            # Each worker opens the workbook once, then parses and converts the sheets it is given.
+            # map returns results in submission order, so the merge order is the same as the serial path.
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                     initargs=(self.get_workbook(),)) as executor:
+                sheets = list(executor.map(convert_sheet, range(1, 30)))
+            prev_year = None
+            for cur_year, *_ in sheets:
+                check_year_order(prev_year, cur_year, self.get_workbook())
+                prev_year = cur_year
+            print(f"Completed: extracted {len(sheets)} workbook sheets in ", round(perf_counter()-start_time,4), " seconds.")
+            return sheets
+        return [self.convert_sheet(df_raw, cur_year) for cur_year, df_raw in self.get_raw_sheets().items()]
+
+
+    # Yield one year of converted sales at a time from one or more workbooks (with the same layout),
+    # parsing each sheet only when it is needed, so memory stays bounded by a single year.
+    # Each sheet's year is read from its month headers, and the years must be newest first across all workbooks.
+    def iter_sales_years(self, workbooks=None):
+        prev_year = None
+        for workbook_path in workbooks or [self.get_workbook()]:
+            with pd.ExcelFile(workbook_path) as workbook:
+                # Skip over the first sheet, which is the year in progress
+                for sheet_num in range(1, 30):
+                    df_raw = workbook.parse(sheet_name=sheet_num)
+                    cur_year = get_sheet_year(df_raw, workbook_path, sheet_num)
+                    check_year_order(prev_year, cur_year, workbook_path)
+                    prev_year = cur_year
+                    cur_year, df_combined, df_store, df_totals, sheet_hash = self.convert_sheet(df_raw, cur_year)
+                    yield {'df_combined': apply_schema(df_combined, COMBINED_SCHEMA),
+                           'df_store': apply_schema(df_store, STORE_SCHEMA),
+                           'df_annual': apply_schema(df_totals.dropna(subset=['annual_sales']), ANNUAL_SCHEMA),
+                           'df_sheets': pd.DataFrame([{'year': cur_year, 'content_hash': sheet_hash}])}
+
+
+    # Years of the sheets iter_sales_years would stream, read from the month headers only, so workbooks
+    # with overlapping or out of order years are rejected before anything is loaded. Raises ValueError.
+    def get_workbook_years(self, workbooks=None):
+        workbook_years = {}
+        prev_year = None
+        for workbook_path in workbooks or [self.get_workbook()]:
+            workbook_years[workbook_path] = []
+            with pd.ExcelFile(workbook_path) as workbook:
+                for sheet_num in range(1, 30):
+                    cur_year = get_sheet_year(workbook.parse(sheet_name=sheet_num, nrows=5), workbook_path, sheet_num)
+                    check_year_order(prev_year, cur_year, workbook_path)
+                    prev_year = cur_year
+                    workbook_years[workbook_path].append(cur_year)
+        return workbook_years
+
+
+    def convert_sheet(self, df_raw, cur_year):
+        return (cur_year, self.get_combined_df(df_raw, cur_year), self.get_store_df(df_raw, cur_year),
+                self.get_totals_df(df_raw, cur_year), get_sheet_hash(df_raw))
 
 
     # Load combined sales dataframes
     def load_combined_sales_df(self):
-        # Skip over FY2022, which is in progress. Dataset will be based on 1992 - 2021
-        for sheet_num in range(1, 30):
-            self.cur_year = 2022 - sheet_num
-            # Access Excel sheet from Census.gov website
-            self.df_raw = pd.read_excel("https://www.census.gov/retail/mrts/www/mrtssales92-present.xls", sheet_name=sheet_num)
-            # Get converted combined sales
-            self.df_combined_sales = self.df_combined_sales.append(self.get_combined_df())
+        # Get converted combined sales
+        self.df_combined_sales = apply_schema(pd.concat([self.get_combined_df(df_raw, cur_year)
+                                                         for cur_year, df_raw in self.get_raw_sheets().items()]),
+                                              COMBINED_SCHEMA)
 
 
     # Load store sales dataframes
     def load_store_sales_df(self):
-        # Skip over FY2022, which is in progress. Dataset will be based on 1992 - 2021
-        for sheet_num in range(1, 30):
-            self.cur_year = 2022 - sheet_num
-            # Access Excel sheet from Census.gov website
-            self.df_raw = pd.read_excel("https://www.census.gov/retail/mrts/www/mrtssales92-present.xls", sheet_name=sheet_num)
-            # Get converted store sales
-            self.df_store_sales = self.df_store_sales.append(self.get_store_df())
+        # Get converted store sales
+        self.df_store_sales = apply_schema(pd.concat([self.get_store_df(df_raw, cur_year)
+                                                      for cur_year, df_raw in self.get_raw_sheets().items()]),
+                                           STORE_SCHEMA)
 
 
     # Load totals (annual sales) for retail combined sales and store sales dataframes
     def load_total_df(self):
         start_time = perf_counter()
         print("Processing: retrieving annual sales from census.gov")
-        # Skip over FY2022, which is in progress. Dataset will be based on 1992 - 2021
-        for sheet_num in range(1, 30):
-            self.cur_year = 2022 - sheet_num
-            # Access Excel sheet from Census.gov website
-            self.df_raw = pd.read_excel("https://www.census.gov/retail/mrts/www/mrtssales92-present.xls", sheet_name=sheet_num)
-            # Get annual sales
-            self.df_totals = self.df_totals.append(self.get_totals_df())
+        # Get annual sales
+        self.df_totals = apply_schema(pd.concat([self.get_totals_df(df_raw, cur_year)
+                                                 for cur_year, df_raw in self.get_raw_sheets().items()]),
+                                      ANNUAL_SCHEMA)
         # Census.gov does not calculate totals for any categories with missing monthly values
         # So, drop those rows from the df Source: https://stackoverflow.com/a/45466263/848353
         self.df_totals.dropna(subset=['annual_sales'], inplace=True)
@@ -77,77 +191,101 @@ class GetSalesDF:
 
 
     # Get retail combined sales
-    def get_combined_df(self):
+    def get_combined_df(self, df_raw, cur_year):
         # Access retail sales section
-        df_combined_unf = self.df_raw.iloc[5:12, 1:14]
+        df_combined_unf = df_raw.iloc[5:12, 1:14]
 
         # Assign column names except "cat_code", which is not part of retail sales
         df_combined_unf.columns=self.col_names[1:]
 
-        # Create temp df
-        df_combined = pd.DataFrame(columns=["sales_date", "sales", "cat_name"])
-
-        # Assign sales from all months
-        df_combined["sales"] = df_combined_unf.iloc[:,1:14].stack()
-
-        # Loop thru 1st index (row number)
-        for row in range(5,12):
-            # Assign cat_name to the correct rows
-            df_combined.loc[row]["cat_name"] = df_combined_unf.cat_name.loc[row]
-
-            # Loop through 2nd index (month number)
-            for month in range(1,13):
-                # Assign sales_date with month based on 2nd index
-                df_combined.loc[row].loc[f"{month}"]["sales_date"] = datetime.strptime(f"{self.cur_year}-{month}-1", '%Y-%m-%d').date()
-
-        # Drop row tracker from index
-        df_combined = df_combined.droplevel(0)
-        
-        # Replace "(NA)" and "(S)" values with nans
-        df_combined["sales"].replace(to_replace=["(NA)","(S)"], value=np.nan, inplace=True)
-        
-        return df_combined
+        return self.melt_months(df_combined_unf, cur_year, ["cat_name"])
 
 
     # Get store sales
-    def get_store_df(self):
+    def get_store_df(self, df_raw, cur_year):
         # Access retail sales section
-        df_store_unf = self.df_raw.iloc[12:71, 0:14]
+        df_store_unf = df_raw.iloc[12:71, 0:14]
         
         # Assign column names
         df_store_unf.columns=self.col_names
 
-        # Create temp df
-        df_store = pd.DataFrame(columns=["sales_date", "sales", "cat_code", "cat_name"])
+        # NAICS codes are stored as text
+        df_store_unf = df_store_unf.assign(cat_code=df_store_unf.cat_code.astype(str))
+
+        return self.melt_months(df_store_unf, cur_year, ["cat_code", "cat_name"])
+
+
+    # Reshape one row per category (with a column per month) into one row per month
+    def melt_months(self, df_unf, cur_year, cat_cols):
+        month_cols = self.col_names[2:]
+        # Flatten sales row by row, which is the same (row, month) order as DataFrame.stack
+        sales = df_unf[month_cols].to_numpy().ravel()
+        rows = np.repeat(np.arange(df_unf.shape[0]), len(month_cols))
+        months = np.tile(np.arange(len(month_cols)), df_unf.shape[0])
+
+        # Skip empty cells, as DataFrame.stack does
+        is_value = pd.notna(sales)
+        rows, months = rows[is_value], months[is_value]
+
+        # Build every sales_date at once from the year and month offsets
+        sales_date = (np.datetime64(f"{cur_year}-01", "M") + months).astype("datetime64[D]")
+
+        # Keep the month number as the index
+        df_long = pd.DataFrame({"sales_date": sales_date, "sales": sales[is_value]},
+                               index=pd.Index(np.array(month_cols, dtype=object)[months]))
+        # Broadcast cat_code and cat_name to every month of their row
+        for col in cat_cols:
+            df_long[col] = df_unf[col].to_numpy()[rows]
 
-        # Assign sales from all months
-        df_store["sales"] = df_store_unf.iloc[:,2:15].stack()
-        
-        # Loop thru 1st index (row number)
-        for row in range(12,70):
-            # Assign cat_code and cat_name to the correct rows
-            df_store.loc[row]["cat_code"] = f"{df_store_unf.cat_code.loc[row]}"
-            df_store.loc[row]["cat_name"] = df_store_unf.cat_name.loc[row]
-
-            # Loop through 2nd index (month number)
-            for month in range(1,13):
-                # Assign sales_date with month based on 2nd index
-                df_store.loc[row].loc[f"{month}"]["sales_date"] = datetime.strptime(f"{self.cur_year}-{month}-1", '%Y-%m-%d').date()
-
-        # Drop row tracker from index
-        df_store = df_store.droplevel(0)
-        
         # Replace "(NA)" and "(S)" values with nans
-        df_store["sales"].replace(to_replace=["(NA)","(S)"], value=np.nan, inplace=True)
+        df_long["sales"] = df_long["sales"].replace(to_replace=["(NA)","(S)"], value=np.nan)
         
-        return df_store
+        return df_long
 
 
     # Get annual sales from combined and store sales
-    def get_totals_df(self):
+    def get_totals_df(self, df_raw, cur_year):
         df_source_totals = pd.DataFrame(columns=["year", "cat_name", "annual_sales"])
         # Assign totals (either total or CY) along corresponding category name (NAICS)
-        df_source_totals["cat_name"] = self.df_raw.iloc[5:69,1]
-        df_source_totals["annual_sales"] = self.df_raw.iloc[5:69,14]
-        df_source_totals['year'] = self.cur_year
-        return df_source_totals
\ No newline at end of file
+        df_source_totals["cat_name"] = df_raw.iloc[5:69,1]
+        df_source_totals["annual_sales"] = df_raw.iloc[5:69,14]
+        df_source_totals['year'] = cur_year
+        # Replace "(NA)" and "(S)" totals with nans, so the column is numeric like the monthly sales
+        df_source_totals["annual_sales"] = df_source_totals["annual_sales"].replace(to_replace=["(NA)","(S)"], value=np.nan)
+        return df_source_totals
+
+# Year of a raw sheet, from its month headers (e.g. "Jan. 2021")
+def get_sheet_year(df_raw, workbook_path, sheet_num):
+    years = {int(year) for header in df_raw.iloc[4, 2:14].astype(str) for year in re.findall(r"\b(\d{4})\b", header)}
+    if len(years) != 1:
+        raise ValueError(f"sheet {sheet_num} of {workbook_path} has no single year in its month headers")
+    return years.pop()
+
+
+# Streamed years must be unique and newest first, so each year's neighbouring months are known when it is cleaned
+def check_year_order(prev_year, cur_year, workbook_path):
+    if prev_year is not None and cur_year >= prev_year:
+        raise ValueError(f"{workbook_path} has year {cur_year} after {prev_year}. " +
+                         "Workbooks must not overlap and must be given newest first.")
+
+
+# Content hash of a raw sheet, used by the incremental load to find new or changed sheets
+def get_sheet_hash(df_raw):
+    return hashlib.sha256(pd.util.hash_pandas_object(df_raw.astype(str), index=True).values.tobytes()).hexdigest()
+
+
+# Workbook handle and converter used by each extract worker process
+worker_workbook = None
+worker_sales_df = None
+
+
+def init_worker(workbook):
+    global worker_workbook, worker_sales_df
+    worker_workbook = pd.ExcelFile(workbook)
+    worker_sales_df = GetSalesDF(None)
+    worker_sales_df.workbook = workbook
+
+
+def convert_sheet(sheet_num):
+    df_raw = worker_workbook.parse(sheet_name=sheet_num)
+    return worker_sales_df.convert_sheet(df_raw, get_sheet_year(df_raw, worker_sales_df.workbook, sheet_num))
@@ -0,0 +1,20 @@
+import pandas as pd
+
+# Compact column types for the extracted sales frames.
+# Categories store each repeated cat_code/cat_name once, float32 holds every MRTS value exactly
+# (all are below 2^24) and leaves room for the nans that are interpolated in transform.clean.
+COMBINED_SCHEMA = {"sales_date": "datetime64[ns]", "sales": "Int32", "cat_name": "category"}
+STORE_SCHEMA = {"sales_date": "datetime64[ns]", "sales": "float32", "cat_code": "category", "cat_name": "category"}
+# Annual sales stay float64, so they compare directly with the Decimal sums returned by MYSQL
+ANNUAL_SCHEMA = {"year": "int16", "cat_name": "category", "annual_sales": "float64"}
+
+
+def apply_schema(df, schema):
+    # Only convert the columns that do not already have the expected type
+    changes = {col: dtype for col, dtype in schema.items() if col in df.columns and str(df[col].dtype) != dtype}
+    if not changes:
+        return df
+    # Numeric values are parsed first, so object columns with nans convert to the nullable types
+    numeric = {col: pd.to_numeric(df[col]) for col, dtype in changes.items()
+               if dtype in ("Int32", "float32", "float64") and df[col].dtype == object}
+    return df.assign(**numeric).astype(changes)
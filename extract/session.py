@@ -0,0 +1,73 @@
+import sys
+from time import perf_counter
+import extract.snapshot as snapshot
+from extract.get_sales_df import GetSalesDF
+
+# Extraction sessions of this process by (workers, rebuild), shared by every Clean instance and by validation
+sessions = {}
+
+
+def get_session(workers=1, rebuild=False):
+    if (workers, rebuild) not in sessions:
+        sessions[(workers, rebuild)] = ExtractSession(workers, rebuild)
+    return sessions[(workers, rebuild)]
+
+
+class ExtractSession:
+
+    def __init__(self, workers=1, rebuild=False):
+        # Ignore any saved snapshot and extract from the workbook again
+        self.rebuild = rebuild
+        # Parses each workbook sheet once, then each frame below is derived from those sheets
+        self.sales_df = GetSalesDF(None, workers)
+        # Combined, store, annual and sheet hash frames, each filled in on its first request
+        self.frames = {}
+
+
+    # All sales dataframes
+    def get_all_sales(self):
+        return {name: self.get_frame(name) for name in snapshot.frame_names}
+
+
+    def get_combined_sales(self):
+        return self.get_frame('df_combined')
+
+
+    def get_store_sales(self):
+        return self.get_frame('df_store')
+
+
+    def get_annual_sales(self):
+        return self.get_frame('df_annual')
+
+
+    # A single frame, from the snapshot of this workbook when it was saved, otherwise derived
+    # from the parsed sheets and saved to the snapshot for later runs
+    def get_frame(self, name):
+        if name not in self.frames:
+            df = None if self.rebuild else snapshot.load_frame(name)
+            if df is not None:
+                self.frames[name] = df
+                return df
+            start_time = perf_counter()
+            print(f"Processing: retrieving {name} from census.gov")
+            try:
+                self.extract_frame(name)
+            except ValueError as e:
+                print("----- Error: sales data not extracted from the workbook -----\n", e)
+                return sys.exit(1)
+            print(f"Completed: retrieved {name} from census.gov in ", round(perf_counter()-start_time,4), " seconds.")
+        return self.frames[name]
+
+
+    def extract_frame(self, name):
+        # Worker processes parse and convert every sheet in one pass, so with workers
+        # the first request extracts (and saves) every frame that is not loaded yet
+        if self.sales_df.workers > 1 and self.sales_df.raw_sheets is None:
+            for frame_name, df in self.sales_df.get_all_sales_df().items():
+                if frame_name not in self.frames:
+                    self.frames[frame_name] = df
+                    snapshot.save_frame(frame_name, df)
+        else:
+            self.frames[name] = self.sales_df.get_sales_frame(name)
+            snapshot.save_frame(name, self.frames[name])
@@ -0,0 +1,71 @@
+import os
+import hashlib
+import tempfile
+from time import perf_counter
+import pandas as pd
+import extract.workbook_cache as workbook_cache
+
+# Parquet support is optional. Without pyarrow, every run extracts from the workbook.
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Bump when the snapshot layout changes
+SNAPSHOT_VERSION = 2
+
+snapshot_dir = os.path.join(workbook_cache.source['cache_dir'], "snapshots")
+frame_names = ['df_combined', 'df_store', 'df_annual', 'df_sheets']
+
+
+# Snapshots are keyed by the workbook contents and the code that converts it
+def get_key():
+    sha256 = hashlib.sha256()
+    sha256.update(workbook_cache.get_workbook_hash().encode())
+    sha256.update(str(SNAPSHOT_VERSION).encode())
+    for code_file in ["get_sales_df.py", "schema.py"]:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), code_file), "rb") as f:
+            sha256.update(f.read())
+    return sha256.hexdigest()
+
+
+# Path of one frame in the snapshot of this workbook
+def get_frame_path(name):
+    return os.path.join(snapshot_dir, get_key(), f"{name}.parquet")
+
+
+# One frame of the snapshot (None when it has not been saved). Each frame is saved on its own,
+# so a run that only needs some frames only extracts and saves those.
+def load_frame(name):
+    if pyarrow is None:
+        return None
+    path = get_frame_path(name)
+    if not os.path.isfile(path):
+        return None
+    start_time = perf_counter()
+    try:
+        df = pd.read_parquet(path)
+    except Exception as e:
+        print(f"---- Warning: {name} snapshot not loaded, extracting from workbook instead ->\n", e)
+        return None
+    print(f"Completed: loaded {name} snapshot in ", round(perf_counter()-start_time,4), " seconds.")
+    return df
+
+
+def save_frame(name, df):
+    if pyarrow is None:
+        return
+    path = get_frame_path(name)
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file then rename it, so a partial frame is never loaded
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as tmp:
+            tmp_path = tmp.name
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        # A missing snapshot only costs speed, so keep going
+        print(f"---- Warning: {name} snapshot not saved ->\n", e)
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,115 @@
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import urllib.request
+from datetime import datetime, timedelta
+from time import perf_counter
+import yaml
+
+# Get workbook source parameters
+with open("./extract/source.yaml", "r") as stream:
+    try:
+        source = yaml.safe_load(stream)
+    except yaml.YAMLError as exc:
+        print(exc)
+
+manifest_path = os.path.join(source['cache_dir'], "manifest.yaml")
+
+# Local workbook path and content hash, resolved once per process
+workbook_path = None
+workbook_hash = None
+
+
+def get_workbook():
+    global workbook_path, workbook_hash
+    if workbook_path is None:
+        # Offline mode: use a local workbook and never contact census.gov
+        offline_file = os.environ.get("MRTS_WORKBOOK") or source['offline_file']
+        if offline_file:
+            if not os.path.isfile(offline_file):
+                print(f"---- Error: offline workbook ({offline_file}) not found")
+                sys.exit(1)
+            workbook_path = offline_file
+            workbook_hash = hash_file(offline_file)
+        else:
+            workbook_path, workbook_hash = get_cached_workbook()
+    return workbook_path
+
+
+def get_workbook_hash():
+    get_workbook()
+    return workbook_hash
+
+
+def get_cached_workbook():
+    manifest = read_manifest()
+    entry = manifest.get(source['url'])
+    # Reuse the cached copy while it is fresh
+    if entry is not None:
+        cached_file = os.path.join(source['cache_dir'], entry['file'])
+        fetched_at = datetime.fromisoformat(entry['fetched_at'])
+        is_fresh = datetime.now() - fetched_at < timedelta(hours=source['max_age_hours'])
+        if is_fresh and os.path.isfile(cached_file):
+            print(f"Completed: using cached workbook ({entry['sha256'][:12]}) fetched at {entry['fetched_at']}")
+            return cached_file, entry['sha256']
+    return fetch_workbook(manifest)
+
+
+def fetch_workbook(manifest):
+    start_time = perf_counter()
+    print("Processing: downloading workbook from census.gov")
+    os.makedirs(source['cache_dir'], exist_ok=True)
+    # Download to a temp file first, so a failed download never replaces a good copy
+    tmp_path = None
+    try:
+        request = urllib.request.Request(source['url'], headers={"User-Agent": "Mozilla/5.0"})
+        with urllib.request.urlopen(request) as response, \
+             tempfile.NamedTemporaryFile(dir=source['cache_dir'], delete=False) as tmp:
+            tmp_path = tmp.name
+            shutil.copyfileobj(response, tmp)
+    except Exception as e:
+        # Never leave a partial download in the cache
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        # An older copy is better than no workbook
+        entry = manifest.get(source['url'])
+        if entry is None or not os.path.isfile(os.path.join(source['cache_dir'], entry['file'])):
+            print("---- Error: workbook not downloaded from census.gov ->\n", e)
+            sys.exit(1)
+        print(f"---- Warning: workbook not downloaded from census.gov, using the cached copy ({entry['sha256'][:12]}) " +
+              f"fetched at {entry['fetched_at']} ->\n", e)
+        return os.path.join(source['cache_dir'], entry['file']), entry['sha256']
+    # Store workbook by content hash, so unchanged downloads share one file
+    sha256 = hash_file(tmp_path)
+    file_name = sha256 + os.path.splitext(source['url'])[1]
+    cached_file = os.path.join(source['cache_dir'], file_name)
+    os.replace(tmp_path, cached_file)
+    manifest[source['url']] = {'sha256': sha256,
+                               'file': file_name,
+                               'size': os.path.getsize(cached_file),
+                               'fetched_at': datetime.now().isoformat(timespec='seconds')}
+    write_manifest(manifest)
+    print(f"Completed: downloaded workbook ({sha256[:12]}) from census.gov in ", round(perf_counter()-start_time,4), " seconds.")
+    return cached_file, sha256
+
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def read_manifest():
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, "r") as stream:
+        return yaml.safe_load(stream) or {}
+
+
+def write_manifest(manifest):
+    with open(manifest_path, "w") as stream:
+        yaml.safe_dump(manifest, stream)
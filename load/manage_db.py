@@ -1,54 +1,40 @@
 from time import perf_counter
-import sqlalchemy
-import yaml
+import os
 import sys
-import mysql.connector
 import atexit
+import queue
+import threading
+import uuid
 import pandas as pd
-from time import perf_counter
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import transform.clean as clean
 import load.validation as validation
+import load.storage as storage
+import load.result_cache as result_cache
+from load.storage import get_table_name
+
+# Data version of the loaded tables, read once per process ("" when there is none)
+data_version = None
 
-# Get database parameters
-with open("./load/db.yaml", "r") as stream:
-    try:
-        db = yaml.safe_load(stream)
-    except yaml.YAMLError as exc:
-        print(exc)
-
-config = {
-    'user':         db['user'],
-    'password':     db['pwrd'],
-    'host':         db['host'],
-    'port':         db['port'],
-    'auth_plugin': 'mysql_native_password'
-}
 
-# Create MYSQL connections
-try : 
-    cnx = mysql.connector.connect(**config)
-    cursor = cnx.cursor()
-except Exception as e:
-    print("---- Error: mysql connection not created ->\n", e) 
-    sys.exit(1) 
-
-# Create SQLAlchemy connections 
-try:
-    # Create DB connection using sqlalchemy
-    db_conn = sqlalchemy.create_engine('mysql+mysqlconnector://{0}:{1}@{2}/{3}'.
-                                               format(db['user'], db['pwrd'], 
-                                                      db['host'], db['db']))
-except Exception as e:
-    print("---- Error: sqlalchemy connection not created -----\n", e)  
-    sys.exit(1)  
+# Raised when load chunks fail, with every failed chunk's (table, chunk, error)
+class LoadError(Exception):
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"{len(errors)} load chunk(s) failed")
+
+
+    def __str__(self):
+        return "\n".join([super().__str__()] + [f"\t{table_name} ({chunk}): {error}" for table_name, chunk, error in self.errors])
 
 
 def create_db():
     start_time = perf_counter()
     print("Processing: creating mrts database")  
     try:
-        cursor.execute("CREATE DATABASE IF NOT EXISTS mrts")
+        storage.get_storage().create_db()
     except Exception as e:
         print("----- Error: mrts database not created -----\n", e) 
         return sys.exit(1)   
@@ -58,286 +44,524 @@ def create_db():
 def create_tables():
     start_time = perf_counter()
     print("Processing: creating tables") 
-    # SQL STMT: Create NAICS Code table
-    create_combined_sales = """CREATE TABLE IF NOT EXISTS combined_sales(
-        id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-        sales_date DATE NOT NULL,
-        sales INT,
-        cat_name VARCHAR(500) NOT NULL,
-        CONSTRAINT uc_combined_sales UNIQUE (sales_date, sales, cat_name))
-        ENGINE=InnoDB;"""
-    # SQL STMT: Create store sales table
-    create_store_sales = """CREATE TABLE IF NOT EXISTS store_sales (
-        id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-        sales_date DATE NOT NULL,
-        sales INT, 
-        cat_name VARCHAR(500) NOT NULL, 
-        cat_code VARCHAR(50) NOT NULL,
-        CONSTRAINT uc_sales UNIQUE (sales_date, sales, cat_name, cat_code))
-        ENGINE=InnoDB;"""
     try:
-        cursor.execute("USE mrts")
-        # Create combined sales table   
-        cursor.execute(create_combined_sales)
-        # Create store sale table   
-        cursor.execute(create_store_sales)
+        backend = storage.get_storage()
+        backend.create_tables()
+        # Sales loaded before the summary tables were added are summarized once
+        summarize = backend.count_sales('annual_sales') == 0 and backend.count_sales('combined_sales') > 0
     except Exception as e:
         print("----- Error: tables not created -----\n", e) 
         return sys.exit(1)  
     print("Completed: created tables in ", round(perf_counter()-start_time,4), " seconds.") 
+    if summarize:
+        refresh_summaries()
 
 
-def insert_all_sales():
+def insert_all_sales(workers=1, rebuild=False, interpolation="linear"):
     create_db()
     create_tables()
     # Increase performance by retrieving data for all tables at once
-    df_all_sales = clean.Clean().get_all_sales()
-    insert_combined_sales(df_all_sales['df_combined'])
-    insert_store_sales(df_all_sales['df_store'])
+    df_all_sales = clean.Clean(workers, rebuild, interpolation).get_all_sales()
+    # Load into staging tables, so readers keep seeing the current tables until the swap
+    staging_state = create_staging_tables()
+    try:
+        insert_sales_concurrently(df_all_sales, staging=True)
+    except LoadError as e:
+        # The live tables were never touched, so discarding the staging tables rolls the whole load back
+        drop_staging_tables()
+        print("----- Error: all tables not appended, the current tables are unchanged -----\n", e)
+        return sys.exit(1)
     # Verify the correct number of records and values were 
     # inserted into the db compared to the source data.
-    validation.validate_all(df_all_sales)
-    
+    validation.validate_all(df_all_sales, staging=True)
+    swap_staging_tables(staging_state)
+    # Summarize the new tables as the final step
+    refresh_summaries()
+    # Cached reader results of the previous data are no longer used
+    update_data_version()
+    # Record what was loaded, so incremental loads only process new or changed sheets
+    update_watermark(get_watermark_rows(df_all_sales))
+
 
-def insert_combined_sales(df_combined):
+def insert_all_sales_streaming(workbooks=None, queue_size=2, interpolation="linear"):
+    create_db()
+    create_tables()
     start_time = perf_counter()
-    print("Processing: appending combined_sales table")  
-    # Add to bottom of combined_sales table
-    with db_conn.connect() as conn:
+    print("Processing: streaming cleaned years into all tables")
+    # Read every sheet's year before loading anything, so overlapping workbooks are rejected up front
+    try:
+        clean.Clean(interpolation=interpolation).get_stream_years(workbooks)
+    except ValueError as e:
+        print("----- Error: workbooks not streamed, the current tables are unchanged -----\n", e)
+        return sys.exit(1)
+    # Stream into staging tables, so readers never see a partly loaded dataset
+    staging_state = create_staging_tables()
+    # Cleaned years wait here for the loader. When the queue is full the producer blocks,
+    # so no more than queue_size years are held in memory while the database catches up.
+    years_queue = queue.Queue(maxsize=queue_size)
+    producer = threading.Thread(target=produce_clean_years, args=(years_queue, workbooks, interpolation), daemon=True)
+    producer.start()
+    count_years = 0
+    watermark_rows = []
+    while True:
+        dict_year_sales = years_queue.get()
+        # End of the stream
+        if dict_year_sales is None:
+            break
+        # The producer failed, so stop loading
+        if isinstance(dict_year_sales, BaseException):
+            drop_staging_tables()
+            print("----- Error: streaming stopped while extracting or cleaning, the current tables are unchanged -----\n", dict_year_sales)
+            return sys.exit(1)
+        # Insert, validate and record this year while the producer parses the next sheet
+        year = int(dict_year_sales['df_sheets'].year.iloc[0])
         try:
-            # Using chunksize and multi-insert to increase insertion speed. 
-            df_combined.to_sql(con=conn, name='combined_sales', if_exists='append', index=False, chunksize=1000, method='multi')    
-        except Exception as e:
-            print("----- Error: combined_sales not appended ------\n", e) 
-            return sys.exit(1)   
-    print(f"Completed: appended combined_sales table in ", round(perf_counter()-start_time,4), " seconds.")                                             
+            insert_sales_concurrently(dict_year_sales, staging=True)
+        except LoadError as e:
+            drop_staging_tables()
+            print(f"----- Error: {year} not appended, the current tables are unchanged -----\n", e)
+            return sys.exit(1)
+        validation.validate_all(dict_year_sales, [year], staging=True)
+        # Keep only the year's watermark, so its frames are freed before the next year arrives
+        watermark_rows.extend(get_watermark_rows(dict_year_sales))
+        del dict_year_sales
+        count_years += 1
+    producer.join()
+    swap_staging_tables(staging_state)
+    refresh_summaries()
+    update_data_version()
+    # The watermarks only describe the live tables, so record them after the swap
+    update_watermark(watermark_rows)
+    print(f"Completed: streamed {count_years} years into all tables in ", round(perf_counter()-start_time,4), " seconds.")
+
+
+def produce_clean_years(years_queue, workbooks, interpolation="linear"):
+    try:
+        for dict_year_sales in clean.Clean(interpolation=interpolation).iter_clean_years(workbooks):
+            years_queue.put(dict_year_sales)
+    except BaseException as e:
+        # Hand the error (including sys.exit) to the loader instead of ending only this thread
+        years_queue.put(e)
+        return
+    years_queue.put(None)
 
 
-def insert_store_sales(df_store): 
+def insert_new_sales(workers=1, rebuild=False, interpolation="linear"):
+    create_db()
+    create_tables()
+    start_time = perf_counter()
+    cleaner = clean.Clean(workers, rebuild, interpolation)
+    # Compare each sheet's content hash with the hash recorded when it was last loaded
+    df_sheets = cleaner.get_source_sales()['df_sheets']
+    loaded_hashes = read_watermark()
+    years = [int(year) for year, content_hash in zip(df_sheets.year, df_sheets.content_hash)
+             if loaded_hashes.get(year) != content_hash]
+    if not years:
+        print("Completed: no new or changed sheets since the last load in ", round(perf_counter()-start_time,4), " seconds.")
+        return
+    print(f"Processing: loading new or changed sheets for years {', '.join(str(year) for year in sorted(years))}")
+    # Filled store sales of other years can read the months of the changed years, so reload those years too
+    dependent_years = cleaner.get_dependent_years(years)
+    if dependent_years:
+        print(f"Processing: reloading years {', '.join(str(year) for year in dependent_years)}, which have nans filled from the changed years")
+        years = sorted(set(years) | set(dependent_years))
+    # Clean, insert and validate only the new, changed and dependent years
+    df_new_sales = cleaner.get_all_sales(years)
+    # Load the changed years into staging tables, so the live tables are only changed by a single transaction
+    create_staging_tables()
+    try:
+        insert_sales_concurrently(df_new_sales, staging=True)
+    except LoadError as e:
+        # The watermarks of these years are unchanged, so the next incremental load picks them up again
+        drop_staging_tables()
+        print("----- Error: changed years not appended, the current tables are unchanged -----\n", e)
+        return sys.exit(1)
+    validation.validate_all(df_new_sales, years, staging=True)
+    merge_staging_tables(years)
+    drop_staging_tables()
+    # Only the summaries of the changed years (and the trailing sums reaching into them) are rebuilt
+    refresh_summaries(years)
+    update_data_version()
+    update_watermark(get_watermark_rows(df_new_sales))
+
+
+def create_staging_tables():
+    start_time = perf_counter()
+    print("Processing: creating staging tables")
+    try:
+        staging_state = storage.get_storage().create_staging_tables()
+    except Exception as e:
+        print("----- Error: staging tables not created -----\n", e) 
+        return sys.exit(1)  
+    print("Completed: created staging tables in ", round(perf_counter()-start_time,4), " seconds.") 
+    return staging_state
+
+
+def swap_staging_tables(staging_state):
     start_time = perf_counter()
-    print("Processing: appending store_sales table") 
-    # Add to bottom of store_sales table
-    with db_conn.connect() as conn:
+    print("Processing: swapping staging tables into place")
+    try:
+        storage.get_storage().swap_staging_tables(staging_state)
+    except Exception as e:
+        print("----- Error: staging tables not swapped, the current tables are unchanged -----\n", e) 
+        return sys.exit(1)  
+    print("Completed: swapped staging tables into place in ", round(perf_counter()-start_time,4), " seconds.") 
+
+
+def drop_staging_tables():
+    start_time = perf_counter()
+    print("Processing: dropping staging tables")
+    try:
+        storage.get_storage().drop_staging_tables()
+    except Exception as e:
+        print("----- Error: staging tables not dropped -----\n", e) 
+        return sys.exit(1)  
+    print("Completed: dropped staging tables in ", round(perf_counter()-start_time,4), " seconds.") 
+
+
+def merge_staging_tables(years):
+    start_time = perf_counter()
+    print("Processing: replacing changed years in all tables")
+    try:
+        storage.get_storage().merge_staging_tables(years)
+    except Exception as e:
+        print("----- Error: changed years not replaced, the current tables are unchanged -----\n", e) 
+        return sys.exit(1)  
+    print("Completed: replaced changed years in all tables in ", round(perf_counter()-start_time,4), " seconds.") 
+
+
+# Rebuild the summary tables of the given years from the sales tables (every year when years is None)
+def refresh_summaries(years=None):
+    start_time = perf_counter()
+    print("Processing: refreshing summary tables" + (f" for years {', '.join(str(year) for year in sorted(years))}" if years else ""))
+    try:
+        storage.get_storage().refresh_summaries(years)
+    except Exception as e:
+        print("----- Error: summary tables not refreshed -----\n", e) 
+        return sys.exit(1)  
+    print("Completed: refreshed summary tables in ", round(perf_counter()-start_time,4), " seconds.") 
+
+
+def get_data_version():
+    global data_version
+    if data_version is None:
         try:
-            # Using chunksize and multi-insert to increase insertion speed. 
-            df_store.to_sql(con=conn, name='store_sales', if_exists='append', index=False, chunksize=1000, method='multi')      
+            data_version = storage.get_storage().read_data_version() or ""
         except Exception as e:
-            print("----- Error: store_sales not appended -----\n", e) 
-            return sys.exit(1)   
-    print(f"Completed: appended store_sales table in ", round(perf_counter()-start_time,4), " seconds.") 
+            # Databases loaded before the data version was added have no etl_metadata table
+            print("---- Warning: data version not read, reader results are not cached ->\n", e)
+            data_version = ""
+    return data_version
+
+
+# Replace the data version with a new random one, so no earlier version (even from a dropped database) matches it
+def update_data_version():
+    global data_version
+    start_time = perf_counter()
+    print("Processing: updating data version")
+    new_version = uuid.uuid4().hex
+    try:
+        storage.get_storage().update_data_version(new_version, datetime.now().replace(microsecond=0))
+    except Exception as e:
+        print("----- Error: data version not updated -----\n", e) 
+        return sys.exit(1)  
+    data_version = new_version
+    print("Completed: updated data version in ", round(perf_counter()-start_time,4), " seconds.") 
+
+
+def read_watermark():
+    try:
+        return storage.get_storage().read_watermark()
+    except Exception as e:
+        print("----- Error: reading etl_watermark table -----\n", e) 
+        return sys.exit(1)  
+
+
+# Year, content hash and last month loaded of each sheet
+def get_watermark_rows(df_all_sales):
+    last_sales_dates = df_all_sales['df_combined'].groupby(df_all_sales['df_combined'].sales_date.dt.year).sales_date.max()
+    return [(int(year), content_hash, last_sales_dates[year].date())
+            for year, content_hash in zip(df_all_sales['df_sheets'].year, df_all_sales['df_sheets'].content_hash)]
 
 
-def read_combined_sales_count(): 
+def update_watermark(watermark_rows):
+    start_time = perf_counter()
+    print("Processing: updating etl_watermark table")
+    loaded_at = datetime.now().replace(microsecond=0)
+    rows = [(year, content_hash, last_sales_date, loaded_at) for year, content_hash, last_sales_date in watermark_rows]
+    try:
+        storage.get_storage().update_watermark(rows)
+    except Exception as e:
+        print("----- Error: etl_watermark table not updated -----\n", e) 
+        return sys.exit(1)  
+    print(f"Completed: updated etl_watermark table (loaded through {max(row[2] for row in rows):%Y-%m}) in ", 
+            round(perf_counter()-start_time,4), " seconds.") 
+    
+
+def insert_combined_sales(df_combined, staging=False):
+    insert_sales(df_combined, get_table_name('combined_sales', staging))
+
+
+def insert_store_sales(df_store, staging=False): 
+    insert_sales(df_store, get_table_name('store_sales', staging))
+
+
+# Number of chunks written at the same time, each on its own pooled connection
+def get_load_workers():
+    return storage.get_db().get('load_workers', 4)
+
+
+# Write combined_sales and store_sales at the same time, with store_sales split into one chunk per year.
+# Each chunk is its own transaction on its own connection, so a failed chunk is rolled back without
+# affecting the others. Every failure is collected and raised together as a LoadError.
+def insert_sales_concurrently(df_all_sales, staging=False):
+    start_time = perf_counter()
+    backend = storage.get_storage()
+    df_store = df_all_sales['df_store']
+    chunks = [(get_table_name('combined_sales', staging), "all years", df_all_sales['df_combined'])] + \
+             [(get_table_name('store_sales', staging), int(year), df_year) 
+              for year, df_year in df_store.groupby(df_store.sales_date.dt.year, sort=False)]
+    print(f"Processing: appending all tables ({len(chunks)} chunks, {get_load_workers()} at a time)") 
+    errors = []
+    with ThreadPoolExecutor(max_workers=get_load_workers()) as executor:
+        futures = {executor.submit(backend.insert_sales, df_chunk, table_name): (table_name, chunk)
+                   for table_name, chunk, df_chunk in chunks}
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            try:
+                future.result()
+            except Exception as e:
+                errors.append((*futures[future], e))
+                # Chunks that have not started are not written
+                for pending in futures:
+                    pending.cancel()
+    if errors:
+        raise LoadError(errors)
+    record_count = df_all_sales['df_combined'].shape[0] + df_store.shape[0]
+    print(f"Completed: appended all tables ({'{:,}'.format(record_count)} records) in ", 
+            round(perf_counter()-start_time,4), " seconds.") 
+
+
+# method only applies to the MYSQL backend (see load.storage.get_load_method)
+def insert_sales(df_sales, table_name, method=None):
+    start_time = perf_counter()
+    backend = storage.get_storage()
+    method = method or (storage.get_load_method() if isinstance(backend, storage.MySQLStorage) else backend.name)
+    print(f"Processing: appending {table_name} table ({method})") 
+    try:
+        backend.insert_sales(df_sales, table_name, method)
+    except Exception as e:
+        print(f"----- Error: {table_name} not appended -----\n", e) 
+        return sys.exit(1)   
+    print(f"Completed: appended {table_name} table ({'{:,}'.format(df_sales.shape[0])} records) in ", 
+            round(perf_counter()-start_time,4), " seconds.") 
+
+
+def read_combined_sales_count(years=None, staging=False): 
     start_time = perf_counter()
     print("Processing: counting records in combined_sales table") 
-     # SQL STMT: Count records in store_sales table
-    count_combined_sales = """SELECT COUNT(*) FROM combined_sales;"""
     try:
-        cursor.execute("USE mrts") 
-        cursor.execute(count_combined_sales)
+        count = storage.get_storage().count_sales(get_table_name('combined_sales', staging), years)
     except Exception as e:
         print("----- Error: counting records in combined_sales table -----\n", e) 
         return sys.exit(1)     
     print("Completed: counting records in combined_sales table in ", round(perf_counter()-start_time,4), " seconds.") 
-    # Return number of records in store_sales table
-    return cursor.fetchone()[0]
+    # Return number of records in combined_sales table
+    return count
 
 
-def read_store_sales_count():
+def read_store_sales_count(years=None, staging=False):
     start_time = perf_counter() 
     print("Processing: counting records in store_sales table") 
-     # SQL STMT: Count records in store_sales table
-    count_store_sales = """SELECT COUNT(*) FROM store_sales;"""
     try:
-        cursor.execute("USE mrts") 
-        cursor.execute(count_store_sales)
+        count = storage.get_storage().count_sales(get_table_name('store_sales', staging), years)
     except Exception as e:
         print("----- Error: counting records in store_sales table -----\n", e) 
         return sys.exit(1) 
     print("Completed: counting records in store_sales table in ", round(perf_counter()-start_time,4), " seconds.") 
     # Return number of records in store_sales table
-    return cursor.fetchone()[0]
+    return count
 
 
-def read_calc_annual_sales(): 
+def read_calc_annual_sales(years=None, staging=False): 
     start_time = perf_counter()
     print("Processing: calculating annual sales from all tables") 
-    calc_annual_sales = """
-                            SELECT YEAR(sales_date), cat_name, SUM(sales)
-                            FROM combined_sales
-                            GROUP BY YEAR(sales_date), cat_name
-                            UNION
-                            SELECT YEAR(sales_date), cat_name, SUM(sales)
-                            FROM store_sales
-                            GROUP BY YEAR(sales_date), cat_name;
-                        """
     try:
-        cursor.execute("USE mrts") 
-        cursor.execute(calc_annual_sales)
+        result = storage.get_storage().calc_annual_sales(years, staging)
     except Exception as e:
         print("----- Error: counting records in store_sales table -----\n", e) 
         return sys.exit(1)  
-    result = cursor.fetchall()
     print(f"Completed: calculated annual sales ({'{:,}'.format(len(result))} records) from all tables in ", 
             round(perf_counter()-start_time,4), " seconds.") 
     return result
 
 
-def read_combined_sales():
+def read_annual_sales_variances(df_source_totals, years=None, staging=False):
     start_time = perf_counter()
-    print("Processing: retrieving data from combined_sales table")
-    # Do not combine by year. Doing so may hide months with empty sales that should be interpolated
-    query = """
-                SELECT sales_date, CAST(sales AS UNSIGNED)
-                FROM combined_sales
-                WHERE cat_name = %s;
-            """
-            
-    # Filter by Kind of Business
-    params = ("Retail and food services sales, total",)
-    try: 
-        cursor.execute("USE mrts;")
-        cursor.execute(query, params)
+    print("Processing: reconciling annual sales with the source totals in the database") 
+    try:
+        result = storage.get_storage().reconcile_annual_sales(df_source_totals, years, staging)
     except Exception as e:
-        print("---- Error: records not retrieved from combined_sales table\n", e)
-        sys.exit(1)
+        print("----- Error: annual sales not reconciled -----\n", e) 
+        return sys.exit(1)  
+    print(f"Completed: reconciled {'{:,}'.format(df_source_totals.shape[0])} annual sales ({'{:,}'.format(len(result))} variances) in ", 
+            round(perf_counter()-start_time,4), " seconds.") 
+    return result
+
 
-    sales_date = []
-    sales = []
-    # Get DB data
-    for row in cursor.fetchall():
-        row_date = row[0]
-        # Convert to datetime, so it can be grouped by years later
-        sales_date.append(datetime(row_date.year, row_date.month, row_date.day))
-        sales.append(row[1])
-    # Setup dictionary to hold DB values
-    dict = {"sales_date": sales_date, "sales":sales}
-    print("Completed: retrieved data from combined_sales table in ", round(perf_counter()-start_time,4), " seconds.") 
-    return pd.DataFrame(dict)
-
-
-def read_percent_change():
+def read_sales_checksums(table_name, key_col, years=None, staging=False):
     start_time = perf_counter()
-    print("Processing: retrieving data from store_sales table")
-    query = """
-                SELECT 
-                    sales_date,
-                    MAX(CASE WHEN cat_code=%s THEN sales END) as mens_clothing,
-                    MAX(CASE WHEN cat_code=%s THEN sales END) as womens_clothing,
-                    MAX(CASE WHEN cat_code=%s THEN sales END) as all_clothing
-                FROM store_sales
-                WHERE sales_date < '2020-01-01'
-                GROUP BY 1;
-            """
-    # Filter by NAICS Codes
-    params = (44811, 44812, 4481)
-    try: 
-        cursor.execute("USE mrts;")
-        cursor.execute(query, params)
+    table_name = get_table_name(table_name, staging)
+    print(f"Processing: calculating checksums of {table_name} table") 
+    try:
+        result = storage.get_storage().read_sales_checksums(table_name, key_col, years)
+    except Exception as e:
+        print(f"----- Error: checksums of {table_name} table not calculated -----\n", e) 
+        return sys.exit(1)  
+    print(f"Completed: calculated checksums of {table_name} table ({'{:,}'.format(len(result))} buckets) in ", 
+            round(perf_counter()-start_time,4), " seconds.") 
+    return result
+
+
+def read_sales_buckets(table_name, key_col, buckets, staging=False):
+    table_name = get_table_name(table_name, staging)
+    try:
+        return storage.get_storage().read_sales_buckets(table_name, key_col, buckets)
     except Exception as e:
-        print("---- Error: records not retrieved from store_sales table\n", e)
+        print(f"---- Error: records not retrieved from {table_name} table\n", e)
         sys.exit(1)
-    sales_date = []
-    mens_clothing = []
-    womens_clothing = []
-    all_clothing = []
-    # Get DB data
-    for row in cursor.fetchall():
-        d = row[0]
-        # Convert to datetime, so it can be grouped by years later
-        sales_date.append(datetime(d.year, d.month, d.day))
-        # Get sales
-        mens_clothing.append(row[1])
-        womens_clothing.append(row[2])
-        all_clothing.append(row[3])
-    print("Completed: retrieved data from store_sales table in ", round(perf_counter()-start_time,4), " seconds.") 
-    # Setup dictionary to hold DB values
-    dict = {"sales_date": sales_date, "mens_clothing":mens_clothing, "womens_clothing":womens_clothing, "all_clothing":all_clothing}
-    return pd.DataFrame(dict)
-
-
-def read_rolling_time():
+
+
+# Periods of read_series: months, and the quarters, years and 12 month trailing sums of the summary tables
+FREQS = ["M"] + list(storage.summary_tables)
+
+# read_series queries checked by explain_readers: each sales table, and store sales with a date range.
+# cat_code is text, so the NAICS codes are passed as text; numbers would make MYSQL cast every row and skip the key.
+explain_series = {
+    'combined_sales': ('combined_sales', {'sales': "Retail and food services sales, total"}, None, None),
+    'store_sales': ('store_sales', {'new_cars': '44111', 'used_cars': '44112'}, None, None),
+    'store_sales by date': ('store_sales', {'mens_clothing': '44811', 'womens_clothing': '44812', 'all_clothing': '4481'}, 
+                            None, '2020-01-01')
+}
+
+
+# Check with EXPLAIN that the read_series queries use an index instead of scanning their whole table
+def explain_readers():
     start_time = perf_counter()
-    print("Processing: retrieving data from store_sales table")
-    query = """
-                SELECT 
-                    sales_date,
-                    MAX(CASE WHEN cat_code=%s THEN sales END) as new_cars,
-                    MAX(CASE WHEN cat_code=%s THEN sales END) as used_cars
-                FROM store_sales
-                GROUP BY 1;
-            """
-    # Filter by NAICS Codes
-    params = (44111,44112)
-    try: 
-        cursor.execute("USE mrts;")
-        cursor.execute(query, params)
+    print("Processing: explaining the analyze reader queries")
+    backend = storage.get_storage()
+    count_full_scans = 0
+    try:
+        for reader, (table_name, cat_codes, start, end) in explain_series.items():
+            query, params = backend.get_series_query(table_name, list(cat_codes.values()), start, end)
+            plans = backend.explain(query, params)
+            if plans is None:
+                print(f"Completed: the {backend.name} backend has no indexes to explain")
+                return
+            for table, access, key, rows, is_full_scan in plans:
+                count_full_scans += is_full_scan
+                print(f"\t{reader}: table {table}, access {access}, key {key}, " + 
+                      f"rows {rows}{' ---- full table scan' if is_full_scan else ''}")
     except Exception as e:
-        print("---- Error: records not retrieved from store_sales table\n", e)
+        print("----- Error: reader queries not explained -----\n", e) 
+        return sys.exit(1)  
+    if count_full_scans:
+        print(f"---- Variance: {count_full_scans} analyze reader(s) scan a whole table")
+        return sys.exit(1)
+    print("Completed: every analyze reader uses an index in ", round(perf_counter()-start_time,4), " seconds.") 
+
+
+# Sales of any number of categories as a wide DataFrame: sales_date, then one float64 column per category.
+# cat_codes is {column name: cat_code}, or a list of cat_codes used as the column names.
+# combined_sales is keyed by cat_name instead, e.g. read_series({'sales': "Retail and food services sales, total"}, table_name='combined_sales')
+# start is inclusive and end exclusive ("YYYY-MM-DD"). freq "Q" or "Y" reads the quarterly or annual totals and "12M" the
+# 12 month trailing sums (nan unless all 12 months are stored), each summing the stored months of its summary table.
+# Results are cached on disk (see get_result_key), so repeated reports do not query the tables again until the next load.
+def read_series(cat_codes, start=None, end=None, freq="M", table_name="store_sales"):
+    start_time = perf_counter()
+    if freq not in FREQS:
+        print(f"---- Error: freq must be one of {', '.join(FREQS)}. Got {freq}")
         sys.exit(1)
-    sales_date = []
-    new_cars = []
-    used_cars = []
-    # Get DB data
-    for row in cursor.fetchall():
-        d = row[0]
-        # Convert to datetime, so it can be grouped by years later
-        sales_date.append(datetime(d.year, d.month, d.day))
-        # Get sales
-        new_cars.append(row[1])
-        used_cars.append(row[2])
-    print("Completed: retrieved data from store_sales table in ", round(perf_counter()-start_time,4), " seconds.") 
-    # Setup dictionary to hold DB values
-    dict = {"sales_date": sales_date, "new_cars":new_cars, "used_cars":used_cars}
-    return pd.DataFrame(dict)
-
-
-def read_trends():
+    if not isinstance(cat_codes, dict):
+        cat_codes = {str(cat_code): str(cat_code) for cat_code in cat_codes}
+    keys = list(cat_codes.values())
+    print(f"Processing: retrieving data from {table_name} table")
+    backend = storage.get_storage()
+    result_key = get_result_key(*backend.get_series_query(table_name, keys, start, end, freq))
+    # Cached with the query's column names, since the key does not include the caller's names
+    df_result = result_cache.load(result_key) if result_key else None
+    if df_result is None:
+        try: 
+            columns = backend.read_series(table_name, keys, start, end, freq)
+        except Exception as e:
+            print(f"---- Error: records not retrieved from {table_name} table\n", e)
+            sys.exit(1)
+        df_result = pd.DataFrame(dict(zip(["sales_date"] + [f"sales_{i}" for i in range(len(keys))], columns)))
+        if result_key:
+            result_cache.save(result_key, df_result)
+        source = f"{table_name} table"
+    else:
+        source = f"{table_name} table (cached)"
+    df = pd.DataFrame(dict(zip(["sales_date"] + list(cat_codes), [df_result[col].to_numpy() for col in df_result.columns])))
+    print(f"Completed: retrieved data from {source} in ", round(perf_counter()-start_time,4), " seconds.") 
+    return df
+
+
+# Annual totals of read_series(freq="Y") indexed by sales_date, with each year labelled by its last day
+# (like monthly sales grouped by year) rather than the first day the summary table stores
+def read_annual_series(cat_codes, start=None, end=None, table_name="store_sales"):
+    df_annual = read_series(cat_codes, start, end, "Y", table_name).set_index("sales_date")
+    df_annual.index = df_annual.index.to_period("Y").to_timestamp(how="end").normalize()
+    return df_annual
+
+
+# Cache key of a reader query: its text, parameters and the current data version.
+# None (not cached) without pyarrow, with result_cache_max_mb 0, or before the first load records a data version.
+def get_result_key(query, params):
+    if not result_cache.is_enabled():
+        return None
+    data_version = get_data_version()
+    return result_cache.get_key(query, params, data_version) if data_version else None
+
+
+# Stream a sales table as DataFrames of at most batch_size rows (read_batch_size in load/db.yaml by default),
+# in (category, sales_date) order, optionally limited to some categories (cat_name for combined_sales) and a date range.
+# Only one batch is held in memory. Callers that need the whole table can pd.concat the batches.
+def iter_sales(table_name="store_sales", cat_codes=None, start=None, end=None, batch_size=None):
     start_time = perf_counter()
-    print("Processing: retrieving data from store_sales table")
-    query = """
-                SELECT 
-                    sales_date,
-                    MAX(CASE WHEN cat_code=%s THEN sales END) as sport_sales,
-                    MAX(CASE WHEN cat_code=%s THEN sales END) as hobby_sales,
-                    MAX(CASE WHEN cat_code=%s THEN sales END) as book_sales
-                FROM store_sales
-                GROUP BY 1;
-            """
-    # Filter by NAICS Codes
-    params = (45111, 45112, 451211)
-    try: 
-        cursor.execute("USE mrts;")
-        cursor.execute(query, params)
+    batch_size = batch_size or storage.get_db().get('read_batch_size', 50000)
+    print(f"Processing: streaming {table_name} table in batches of {'{:,}'.format(batch_size)} records")
+    count = 0
+    try:
+        for columns in storage.get_storage().iter_sales(table_name, cat_codes, start, end, batch_size):
+            df_batch = pd.DataFrame(dict(zip(storage.sales_columns[table_name], columns)))
+            # Sales are stored as whole numbers
+            df_batch["sales"] = df_batch["sales"].astype("Int32")
+            count += df_batch.shape[0]
+            yield df_batch
     except Exception as e:
-        print("---- Error: records not retrieved from store_sales table\n", e)
+        print(f"---- Error: records not streamed from {table_name} table\n", e)
         sys.exit(1)
-    sales_date = []
-    sport_sales = []
-    hobby_sales = []
-    book_sales = []
-    # Get DB data
-    for row in cursor.fetchall():
-        d = row[0]
-        # Convert to datetime, so it can be grouped by years later
-        sales_date.append(datetime(d.year, d.month, d.day))
-        # Get sales
-        sport_sales.append(row[1])
-        hobby_sales.append(row[2])
-        book_sales.append(row[3])
-    print("Completed: retrieved data from store_sales table in ", round(perf_counter()-start_time,4), " seconds.") 
-    # Setup dictionary to hold DB values
-    dict = {"sales_date": sales_date, "sport_sales":sport_sales, "hobby_sales":hobby_sales, "book_sales":book_sales}
-    return pd.DataFrame(dict)
+    print(f"Completed: streamed {table_name} table ({'{:,}'.format(count)} records) in ", round(perf_counter()-start_time,4), " seconds.") 
+
+
+# Export a sales table to a CSV file one batch at a time, so the export runs in bounded memory
+def export_sales(table_name, file_path, batch_size=None):
+    start_time = perf_counter()
+    print(f"Processing: exporting {table_name} table to {file_path}")
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    with open(file_path, "w", newline="", encoding="utf-8") as csv_file:
+        for batch_num, df_batch in enumerate(iter_sales(table_name, batch_size=batch_size)):
+            df_batch.to_csv(csv_file, index=False, header=(batch_num == 0), date_format="%Y-%m-%d")
+    print(f"Completed: exported {table_name} table to {file_path} in ", round(perf_counter()-start_time,4), " seconds.") 
 
 
 def empty_tables():
     start_time = perf_counter()
     print("Processing: emptying tables")
     try:
-        cursor.execute("USE mrts")
-        cursor.execute("TRUNCATE TABLE combined_sales")
-        cursor.execute("TRUNCATE TABLE store_sales")        
+        storage.get_storage().empty_tables()
     except Exception as e:
         print(" ----- Error: tables not emptied -----\n", e) 
         return sys.exit(1)   
@@ -348,7 +572,7 @@ def drop_db():
     start_time = perf_counter()
     print("Processing: dropping mrts database") 
     try:
-        cursor.execute("DROP DATABASE IF EXISTS mrts")
+        storage.get_storage().drop_db()
     except Exception as e:
         print("----- Error: mrts database not dropped ------\n", e) 
         return sys.exit(1)   
@@ -359,9 +583,7 @@ def drop_tables():
     start_time = perf_counter()
     print("Processing: dropping tables")
     try:
-        cursor.execute("USE mrts")
-        cursor.execute("DROP TABLE IF EXISTS combined_sales")
-        cursor.execute("DROP TABLE IF EXISTS store_sales")        
+        storage.get_storage().drop_tables()
     except Exception as e:
         print("----- Error: tables not dropped -----\n", e) 
         return sys.exit(1)   
@@ -370,9 +592,6 @@ def drop_tables():
 
 @atexit.register
 def close_conn():
-    # Close connections
-    cursor.close()
-    cnx.close()
-    # Make sure connection is closed 
-    # Source: https://stackoverflow.com/a/51242577/848353
-    db_conn.dispose()
+    # Close the backend's connections (nothing to close if the database was never used)
+    if storage.storage is not None:
+        storage.storage.close()
@@ -0,0 +1,98 @@
+import os
+import hashlib
+import tempfile
+import pandas as pd
+import load.storage as storage
+
+# Parquet support is optional. Without pyarrow, every read queries the database.
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Bump when the cached file layout changes
+CACHE_VERSION = 1
+
+
+def get_cache_dir():
+    return storage.get_db().get('result_cache_dir', './load/cache')
+
+
+# Size the cache is trimmed to after each write. 0 turns the cache off.
+def get_max_bytes():
+    return int(storage.get_db().get('result_cache_max_mb', 100) * 1024 * 1024)
+
+
+def is_enabled():
+    return pyarrow is not None and get_max_bytes() > 0
+
+
+# Results are keyed by the query text, its parameters and the data version of the last load,
+# so a load that bumps the version leaves every earlier result unused until it is evicted
+def get_key(query, params, data_version):
+    sha256 = hashlib.sha256()
+    sha256.update(str(CACHE_VERSION).encode())
+    sha256.update(query.encode())
+    sha256.update(repr(tuple(params)).encode())
+    sha256.update(data_version.encode())
+    return sha256.hexdigest()
+
+
+def get_path(key):
+    return os.path.join(get_cache_dir(), f"{key}.parquet")
+
+
+def load(key):
+    path = get_path(key)
+    if not os.path.isfile(path):
+        return None
+    try:
+        df = pd.read_parquet(path)
+        # The modification time is the last use, which eviction goes by
+        os.utime(path)
+    except Exception as e:
+        # Evicted by another process or unreadable, so query the database instead
+        print("---- Warning: cached result not loaded, querying the database instead ->\n", e)
+        return None
+    return df
+
+
+def save(key, df):
+    cache_dir = get_cache_dir()
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temp file then rename it, so a partial result is never loaded
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False) as tmp:
+            tmp_path = tmp.name
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, get_path(key))
+        evict()
+    except Exception as e:
+        # A missing result only costs speed, so keep going
+        print("---- Warning: result not cached ->\n", e)
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# Remove the least recently used results until the cache fits in result_cache_max_mb
+def evict():
+    cache_dir = get_cache_dir()
+    files = []
+    for file_name in os.listdir(cache_dir):
+        if file_name.endswith(".parquet"):
+            path = os.path.join(cache_dir, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    total_bytes = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total_bytes <= get_max_bytes():
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
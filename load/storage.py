@@ -0,0 +1,943 @@
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+import yaml
+import sqlalchemy
+import numpy as np
+import pandas as pd
+
+# The embedded backend is optional. Without duckdb, only the MYSQL backend is available.
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Database parameters and the storage backend are created on first use,
+# so importing this module (or running commands that never touch a database) does not connect
+db = None
+storage = None
+storage_lock = threading.Lock()
+
+# Storage backends selectable with "backend" in db.yaml or control.py --backend
+BACKENDS = ["mysql", "duckdb"]
+
+# Sales tables that a full reload builds as staging tables and then swaps in
+sales_tables = ['combined_sales', 'store_sales']
+# Natural key (primary key) and secondary indexes of each sales table
+sales_keys = {
+    'combined_sales': (['cat_name', 'sales_date'], {'ix_combined_sales_date': ['sales_date']}),
+    'store_sales': (['cat_code', 'sales_date'], {'ix_store_sales_date': ['sales_date']})
+}
+# Columns of each sales table
+sales_columns = {
+    'combined_sales': ['sales_date', 'sales', 'cat_name'],
+    'store_sales': ['sales_date', 'sales', 'cat_name', 'cat_code']
+}
+# Summary tables built from the sales tables after each load, by the period read_series sums the months into:
+# annual and quarterly totals, and 12 month trailing sums. Each row is a period of one category of one sales table.
+summary_tables = {'Y': 'annual_sales', 'Q': 'quarterly_sales', '12M': 'trailing_sales'}
+
+
+def get_db():
+    global db
+    if db is None:
+        # Get database parameters
+        with open("./load/db.yaml", "r") as stream:
+            try:
+                db = yaml.safe_load(stream)
+            except yaml.YAMLError as exc:
+                print(exc)
+                sys.exit(1)
+    return db
+
+
+# The process-wide storage backend. The first call picks it (backend argument, otherwise db.yaml).
+def get_storage(backend=None):
+    global storage
+    with storage_lock:
+        if storage is None:
+            backend = backend or get_db().get('backend', 'mysql')
+            if backend == "mysql":
+                storage = MySQLStorage()
+            elif backend == "duckdb":
+                if duckdb is None:
+                    print("---- Error: the duckdb backend needs the duckdb package (pip install duckdb)")
+                    sys.exit(1)
+                storage = DuckDBStorage()
+            else:
+                print(f"---- Error: backend must be one of {', '.join(BACKENDS)}. Got {backend}")
+                sys.exit(1)
+    return storage
+
+
+# Category column a sales table is keyed by (cat_name or cat_code)
+def get_key_col(table_name):
+    return sales_keys[table_name][0][0]
+
+
+# Staging table of a sales table
+def get_table_name(table_name, staging=False):
+    return f"{table_name}_staging" if staging else table_name
+
+
+# How sales frames are loaded into MYSQL: "infile" (LOAD DATA LOCAL INFILE, falling back to executemany),
+# "executemany" (batched INSERTs) or "to_sql" (pandas multi-row INSERTs through SQLAlchemy)
+def get_load_method():
+    return get_db().get('load_method', 'infile')
+
+
+# Rows per temp file write or executemany batch
+def get_load_batch_size():
+    return get_db().get('load_batch_size', 5000)
+
+
+# Operations every backend provides. The SQL shared by all backends is written here with the
+# backend's parameter placeholder. Methods raise on failure; load.manage_db reports the errors.
+class Storage:
+    # Name used in messages
+    name = None
+    # Placeholder for query parameters
+    param = "%s"
+    # Appended to CREATE TABLE statements
+    table_options = ""
+    # Dates of a series query, selected as days since 1970-01-01 so they become datetime64 without a Python date per row
+    series_date = "TO_DAYS(sales_date) - 719528"
+
+
+    # Check out a connection and cursor for one operation. The work is committed when the
+    # operation succeeds and rolled back when it fails. Cursors are unbuffered (rows are read as they are fetched).
+    @contextmanager
+    def get_cursor(self):
+        cnx, cursor = self.connect()
+        try:
+            yield cursor
+            cnx.commit()
+        except BaseException:
+            cnx.rollback()
+            raise
+        finally:
+            cursor.close()
+            cnx.close()
+
+
+    def connect(self):
+        raise NotImplementedError
+
+
+    def create_db(self):
+        raise NotImplementedError
+
+
+    def create_tables(self):
+        raise NotImplementedError
+
+
+    def insert_sales(self, df_sales, table_name, method=None):
+        raise NotImplementedError
+
+
+    # Returns whatever swap_staging_tables needs to finish the staging tables
+    def create_staging_tables(self):
+        raise NotImplementedError
+
+
+    def swap_staging_tables(self, staging_state):
+        raise NotImplementedError
+
+
+    # rows: (sheet_year, content_hash, last_sales_date, loaded_at)
+    def update_watermark(self, rows):
+        raise NotImplementedError
+
+
+    def update_data_version(self, data_version, updated_at):
+        raise NotImplementedError
+
+
+    def empty_tables(self):
+        raise NotImplementedError
+
+
+    def drop_db(self):
+        raise NotImplementedError
+
+
+    def drop_tables(self):
+        raise NotImplementedError
+
+
+    def close(self):
+        pass
+
+
+    # Query plan of each table a query reads: (table, access type, key, rows, full table scan).
+    # None when the backend has no indexes to check.
+    def explain(self, query, params):
+        return None
+
+
+    # WHERE (or AND) clause limiting a read to the given years (no filter when years is None)
+    def get_years_filter(self, years, clause="WHERE"):
+        if years is None:
+            return ""
+        return f" {clause} YEAR(sales_date) IN (" + ", ".join([self.param] * len(years)) + ")"
+
+
+    def count_sales(self, table_name, years=None):
+        # SQL STMT: Count records in a sales table
+        count_sales = f"""SELECT COUNT(*) FROM {table_name}""" + self.get_years_filter(years) + ";"
+        with self.get_cursor() as cursor:
+            cursor.execute(count_sales, tuple(years or ()))
+            return cursor.fetchall()[0][0]
+
+
+    # Annual sales of each category as a derived table (year, cat_name, annual_sales) and its parameters.
+    # The live tables are read from the annual_sales summary. Staging tables are not summarized until
+    # they are swapped in, so their months are summed here.
+    def get_annual_sales_query(self, years=None, staging=False):
+        if staging:
+            years_filter = self.get_years_filter(years)
+            query = " UNION ".join(f"""SELECT YEAR(sales_date) AS year, cat_name, SUM(sales) AS annual_sales
+                                       FROM {get_table_name(table_name, staging)}{years_filter}
+                                       GROUP BY YEAR(sales_date), cat_name""" for table_name in sales_tables)
+            return query, tuple(years or ()) * len(sales_tables)
+        years_filter = self.get_years_filter(years, "AND")
+        query = " UNION ".join(f"""SELECT YEAR(sales_date) AS year, cat_name, SUM(sales) AS annual_sales
+                                   FROM annual_sales WHERE source_table = {self.param}{years_filter}
+                                   GROUP BY YEAR(sales_date), cat_name""" for table_name in sales_tables)
+        return query, tuple(param for table_name in sales_tables for param in [table_name] + list(years or ()))
+
+
+    def calc_annual_sales(self, years=None, staging=False):
+        calc_annual_sales, params = self.get_annual_sales_query(years, staging)
+        with self.get_cursor() as cursor:
+            cursor.execute(calc_annual_sales + ";", params)
+            return cursor.fetchall()
+
+
+    # Compare the source annual totals with the sums of the sales tables in one join, so only the
+    # mismatches leave the database. Returns (year, cat_name, source annual sales, db annual sales).
+    # Like the source data, categories without a source total (missing months) are not compared.
+    def reconcile_annual_sales(self, df_source_totals, years=None, staging=False):
+        annual_sales, params = self.get_annual_sales_query(years, staging)
+        reconcile_annual_sales = f"""
+                            SELECT s.year, s.cat_name, s.annual_sales, d.annual_sales
+                            FROM source_annual_sales s
+                            JOIN ({annual_sales}) d
+                            ON d.year = s.year AND d.cat_name = s.cat_name
+                            WHERE s.annual_sales <> d.annual_sales
+                            ORDER BY s.year, s.cat_name;
+                        """
+        with self.get_cursor() as cursor:
+            self.load_source_totals(cursor, df_source_totals[['year', 'cat_name', 'annual_sales']])
+            try:
+                cursor.execute(reconcile_annual_sales, params)
+                return cursor.fetchall()
+            finally:
+                self.drop_source_totals(cursor)
+
+
+    # Bulk load the source annual totals into the source_annual_sales temporary table of the cursor's connection
+    def load_source_totals(self, cursor, df_source_totals):
+        raise NotImplementedError
+
+
+    def drop_source_totals(self, cursor):
+        raise NotImplementedError
+
+
+    # Row text hashed by the checksums: "key|YYYY-MM-DD|sales" (sales is empty when NULL).
+    # load.validation builds the same text from the source frames.
+    def get_row_text(self, key_col):
+        return f"CONCAT({key_col}, '|', CAST(sales_date AS CHAR), '|', COALESCE(CAST(sales AS CHAR), ''))"
+
+
+    # First 32 bits of the MD5 of each row's text, as a number, so a bucket's digests can be summed in any order
+    def get_row_digest(self, key_col):
+        raise NotImplementedError
+
+
+    # Whole numbers the sales were stored as (interpolated store sales are fractional)
+    def round_sales(self, sales):
+        raise NotImplementedError
+
+
+    # (key, year, row count, sum of row digests) of every (key, year) bucket of a sales table
+    def read_sales_checksums(self, table_name, key_col, years=None):
+        # SQL STMT: Checksum of each bucket
+        read_sales_checksums = f"""SELECT {key_col}, YEAR(sales_date), COUNT(*), SUM({self.get_row_digest(key_col)})
+                                   FROM {table_name}{self.get_years_filter(years)}
+                                   GROUP BY {key_col}, YEAR(sales_date);"""
+        with self.get_cursor() as cursor:
+            cursor.execute(read_sales_checksums, tuple(years or ()))
+            return cursor.fetchall()
+
+
+    # (key, year, row text) of every row in the given (key, year) buckets
+    def read_sales_buckets(self, table_name, key_col, buckets):
+        # SQL STMT: Rows of the mismatching buckets (ranges on the natural key)
+        read_sales_buckets = f"""SELECT {key_col}, YEAR(sales_date), {self.get_row_text(key_col)}
+                                 FROM {table_name}
+                                 WHERE """ + " OR ".join([f"({key_col} = {self.param} AND sales_date >= {self.param} AND sales_date < {self.param})"] * len(buckets)) + ";"
+        params = [param for key, year in buckets for param in (key, f"{year}-01-01", f"{year + 1}-01-01")]
+        with self.get_cursor() as cursor:
+            cursor.execute(read_sales_buckets, tuple(params))
+            return cursor.fetchall()
+
+
+    # One row per period with a column of sales (sales_0, sales_1, ...) for each key in keys.
+    # freq "M" reads the months of the sales table. The other freqs read the summary table of their period,
+    # which is keyed by (source_table, cat_key, sales_date) with sales_date the first day of the period.
+    # The IN filter lets the key narrow the scan to the requested categories.
+    # start is inclusive and end exclusive, compared with the first day of each period.
+    def get_series_query(self, table_name, keys, start=None, end=None, freq="M"):
+        if freq == "M":
+            from_table, key_col, source_filter, source_params = table_name, get_key_col(table_name), "", []
+        else:
+            from_table, key_col = summary_tables[freq], "cat_key"
+            source_filter, source_params = f"source_table = {self.param} AND ", [table_name]
+        # A trailing sum with a missing month is left out (nan), since it sums fewer than 12 stored months
+        full_filter = " AND month_count = 12" if freq == "12M" else ""
+        query = f"SELECT {self.series_date} AS sales_days, " + \
+                ", ".join(f"MAX(CASE WHEN {key_col} = {self.param}{full_filter} THEN sales END) AS sales_{i}" for i in range(len(keys))) + \
+                f" FROM {from_table} WHERE {source_filter}{key_col} IN (" + ", ".join([self.param] * len(keys)) + ")" + \
+                (f" AND sales_date >= {self.param}" if start else "") + \
+                (f" AND sales_date < {self.param}" if end else "") + \
+                " GROUP BY sales_date ORDER BY sales_date;"
+        return query, tuple(list(keys) + source_params + list(keys) + [date for date in (start, end) if date])
+
+
+    # Columns of the series query as arrays: sales_date (datetime64[ns]) and then the float64 sales of each key
+    def read_series(self, table_name, keys, start=None, end=None, freq="M"):
+        query, params = self.get_series_query(table_name, keys, start, end, freq)
+        columns = ["sales_days"] + [f"sales_{i}" for i in range(len(keys))]
+        with self.get_cursor() as cursor:
+            cursor.execute(query, params)
+            df_series = pd.DataFrame.from_records(cursor.fetchall(), columns=columns, coerce_float=True)
+        # Typed conversions of whole columns: day numbers to dates, and missing sales to nan
+        return [df_series.sales_days.to_numpy(dtype="int64").astype("datetime64[D]").astype("datetime64[ns]")] + \
+               [df_series[column].to_numpy(dtype="float64", na_value=np.nan) for column in columns[1:]]
+
+
+    # SQL STMT: Create a summary table (see summary_tables)
+    def get_create_summary_table(self, table_name):
+        return f"""CREATE TABLE IF NOT EXISTS {table_name} (
+            source_table VARCHAR(20) NOT NULL,
+            cat_key VARCHAR(500) NOT NULL,
+            cat_name VARCHAR(500) NOT NULL,
+            sales_date DATE NOT NULL,
+            sales BIGINT,
+            month_count SMALLINT NOT NULL,
+            PRIMARY KEY (source_table, cat_key, sales_date)){self.table_options};"""
+
+
+    # First day of the year or quarter of sales_date
+    def get_period_start(self, freq):
+        raise NotImplementedError
+
+
+    # Rebuild the summary rows of the given years (every year when years is None) from the sales tables,
+    # in one transaction so readers never see a partly refreshed summary.
+    # A trailing sum reaches back 11 months, so the years after the given years are refreshed too.
+    def refresh_summaries(self, years=None):
+        years = sorted(set(years)) if years is not None else None
+        trailing_years = sorted(set(years) | {year + 1 for year in years}) if years is not None else None
+        # Months the refreshed trailing sums reach back to
+        window_years = sorted(set(trailing_years) | {year - 1 for year in trailing_years}) if years is not None else None
+        with self.get_cursor() as cursor:
+            for freq, summary_table in summary_tables.items():
+                refresh_years = trailing_years if freq == "12M" else years
+                cursor.execute(f"DELETE FROM {summary_table}{self.get_years_filter(refresh_years)};", tuple(refresh_years or ()))
+                for table_name in sales_tables:
+                    key_col = get_key_col(table_name)
+                    if freq == "12M":
+                        # SQL STMT: Sum of each month and the 11 before it (a range, so a missing month is not replaced by an older one)
+                        cursor.execute(f"""INSERT INTO {summary_table} (source_table, cat_key, cat_name, sales_date, sales, month_count)
+                                           SELECT source_table, cat_key, cat_name, sales_date, sales, month_count
+                                           FROM (SELECT {self.param} AS source_table, {key_col} AS cat_key, cat_name, sales_date,
+                                                        SUM(sales) OVER w AS sales, COUNT(sales) OVER w AS month_count
+                                                 FROM {table_name}{self.get_years_filter(window_years)}
+                                                 WINDOW w AS (PARTITION BY {key_col} ORDER BY sales_date
+                                                              RANGE BETWEEN INTERVAL 11 MONTH PRECEDING AND CURRENT ROW)) t
+                                           {self.get_years_filter(refresh_years)};""",
+                                       tuple([table_name] + list(window_years or ()) + list(refresh_years or ())))
+                    else:
+                        # SQL STMT: Sum the months of each year or quarter
+                        period_start = self.get_period_start(freq)
+                        cursor.execute(f"""INSERT INTO {summary_table} (source_table, cat_key, cat_name, sales_date, sales, month_count)
+                                           SELECT {self.param}, {key_col}, MAX(cat_name), {period_start}, SUM(sales), COUNT(sales)
+                                           FROM {table_name}{self.get_years_filter(refresh_years)}
+                                           GROUP BY {key_col}, {period_start};""",
+                                       tuple([table_name] + list(refresh_years or ())))
+
+
+    # Rows of a sales table in natural key order, optionally limited to some categories and a date range
+    def get_sales_query(self, table_name, keys=None, start=None, end=None):
+        key_col = get_key_col(table_name)
+        filters = ([f"{key_col} IN (" + ", ".join([self.param] * len(keys)) + ")"] if keys else []) + \
+                  ([f"sales_date >= {self.param}"] if start else []) + \
+                  ([f"sales_date < {self.param}"] if end else [])
+        query = f"SELECT {', '.join(sales_columns[table_name])} FROM {table_name}" + \
+                (" WHERE " + " AND ".join(filters) if filters else "") + \
+                f" ORDER BY {', '.join(sales_keys[table_name][0])};"
+        return query, tuple(list(keys or []) + [date for date in (start, end) if date])
+
+
+    # Stream the rows of a sales table in batches of at most batch_size, each as a list of column arrays.
+    # The cursor is unbuffered, so rows stay on the server until they are fetched and only one batch is held
+    # in memory. The connection stays checked out until the stream is finished or closed.
+    def iter_sales(self, table_name, keys=None, start=None, end=None, batch_size=50000):
+        query, params = self.get_sales_query(table_name, keys, start, end)
+        with self.get_cursor() as cursor:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                yield [np.array(columns[0], dtype="datetime64[D]").astype("datetime64[ns]"),
+                       np.array(columns[1], dtype="float64")] + [np.array(column, dtype=object) for column in columns[2:]]
+
+
+    def drop_staging_tables(self):
+        with self.get_cursor() as cursor:
+            for table_name in sales_tables:
+                cursor.execute(f"DROP TABLE IF EXISTS {get_table_name(table_name, staging=True)}")
+
+
+    # Replace the given years of the live tables with the rows of the staging tables in one transaction,
+    # so readers see either the old or the new years, and a failure leaves the live tables unchanged
+    def merge_staging_tables(self, years):
+        with self.get_cursor() as cursor:
+            for table_name in sales_tables:
+                columns = ", ".join(sales_columns[table_name])
+                for year in years:
+                    # SQL STMT: Delete one year of sales (range on sales_date, so the filter does not wrap the column in a function)
+                    cursor.execute(f"DELETE FROM {table_name} WHERE sales_date >= {self.param} AND sales_date < {self.param};",
+                                   (f"{year}-01-01", f"{year + 1}-01-01"))
+                # SQL STMT: Copy the reloaded years in from the staging table
+                cursor.execute(f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {get_table_name(table_name, staging=True)};")
+
+
+    def read_watermark(self):
+        # SQL STMT: Get the content hash of each loaded sheet
+        with self.get_cursor() as cursor:
+            cursor.execute("""SELECT sheet_year, content_hash FROM etl_watermark;""")
+            return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+    # Version of the loaded data, replaced by every load (None before the first one)
+    def read_data_version(self):
+        # SQL STMT: Get the data version
+        with self.get_cursor() as cursor:
+            cursor.execute(f"""SELECT meta_value FROM etl_metadata WHERE meta_key = {self.param};""", ('data_version',))
+            rows = cursor.fetchall()
+        return rows[0][0] if rows else None
+
+
+class MySQLStorage(Storage):
+    name = "MYSQL"
+    table_options = " ENGINE=InnoDB"
+
+    def __init__(self):
+        db = get_db()
+        # Single SQLAlchemy engine with a connection pool, used for both cursor queries and pandas
+        url = sqlalchemy.engine.URL.create("mysql+mysqlconnector", username=db['user'], password=db['pwrd'],
+                                           host=db['host'], port=db['port'])
+        self.engine = sqlalchemy.create_engine(url, pool_size=db.get('pool_size', 5),
+                                               max_overflow=db.get('pool_max_overflow', 5),
+                                               pool_recycle=db.get('pool_recycle', 3600), pool_pre_ping=True,
+                                               connect_args={'auth_plugin': 'mysql_native_password',
+                                                             # Needed by the LOAD DATA LOCAL INFILE bulk load
+                                                             'allow_local_infile': True,
+                                                             # A stream closed early discards its unread rows
+                                                             'consume_results': True})
+        sqlalchemy.event.listen(self.engine, "connect", self.select_db)
+
+
+    # Select the mrts database once per pooled connection (instead of "USE mrts" before every query).
+    # Before create_db, the database does not exist yet, so the connection is left without one.
+    def select_db(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"USE {get_db()['db']}")
+        except Exception:
+            pass
+        finally:
+            cursor.close()
+
+
+    # A pooled connection per operation, so concurrent callers never share a cursor
+    def connect(self):
+        cnx = self.engine.raw_connection()
+        return cnx, cnx.cursor()
+
+
+    def create_db(self):
+        with self.get_cursor() as cursor:
+            cursor.execute("CREATE DATABASE IF NOT EXISTS mrts")
+        # Pooled connections opened before the database existed have none selected, so open new ones
+        self.engine.dispose()
+
+
+    def create_tables(self):
+        # SQL STMT: Create NAICS Code table
+        # One row per category and month. The natural key is the clustered primary key, so the readers'
+        # category filters are range scans that cover every selected column, and sales_date serves the year ranges.
+        create_combined_sales = f"""CREATE TABLE IF NOT EXISTS combined_sales(
+            sales_date DATE NOT NULL,
+            sales INT,
+            cat_name VARCHAR(500) NOT NULL,
+            {self.get_key_ddl('combined_sales')})
+            ENGINE=InnoDB;"""
+        # SQL STMT: Create store sales table
+        create_store_sales = f"""CREATE TABLE IF NOT EXISTS store_sales (
+            sales_date DATE NOT NULL,
+            sales INT,
+            cat_name VARCHAR(500) NOT NULL,
+            cat_code VARCHAR(50) NOT NULL,
+            {self.get_key_ddl('store_sales')})
+            ENGINE=InnoDB;"""
+        # SQL STMT: Create load watermark table (one row per loaded workbook sheet)
+        create_etl_watermark = """CREATE TABLE IF NOT EXISTS etl_watermark (
+            sheet_year SMALLINT NOT NULL PRIMARY KEY,
+            content_hash CHAR(64) NOT NULL,
+            last_sales_date DATE NOT NULL,
+            loaded_at DATETIME NOT NULL)
+            ENGINE=InnoDB;"""
+        # SQL STMT: Create load metadata table (the data version of the last load)
+        create_etl_metadata = """CREATE TABLE IF NOT EXISTS etl_metadata (
+            meta_key VARCHAR(50) NOT NULL PRIMARY KEY,
+            meta_value VARCHAR(100) NOT NULL,
+            updated_at DATETIME NOT NULL)
+            ENGINE=InnoDB;"""
+        with self.get_cursor() as cursor:
+            # Create combined sales table
+            cursor.execute(create_combined_sales)
+            # Create store sale table
+            cursor.execute(create_store_sales)
+            # Create load watermark table
+            cursor.execute(create_etl_watermark)
+            # Create load metadata table
+            cursor.execute(create_etl_metadata)
+            # Create summary tables
+            for summary_table in summary_tables.values():
+                cursor.execute(self.get_create_summary_table(summary_table))
+            # Tables created before the natural keys were added are migrated in place
+            for table_name in sales_tables:
+                self.migrate_sales_keys(cursor, table_name)
+
+
+    def get_key_ddl(self, table_name):
+        natural_key, indexes = sales_keys[table_name]
+        return ",\n            ".join([f"PRIMARY KEY ({', '.join(natural_key)})"] +
+                                       [f"INDEX {key_name} ({', '.join(columns)})" for key_name, columns in indexes.items()])
+
+
+    # Replace the surrogate id and the (sales_date, sales, ...) unique constraint of older tables with the natural key
+    def migrate_sales_keys(self, cursor, table_name):
+        cursor.execute(f"SHOW COLUMNS FROM {table_name} LIKE 'id'")
+        if not cursor.fetchall():
+            return
+        print(f"Processing: migrating {table_name} to its natural key")
+        natural_key, indexes = sales_keys[table_name]
+        cursor.execute(f"SHOW INDEX FROM {table_name}")
+        old_indexes = {row[2] for row in cursor.fetchall()} - {'PRIMARY'}
+        # A single ALTER, so the table is rebuilt once. It fails if a category has duplicate months.
+        cursor.execute(f"ALTER TABLE {table_name} DROP COLUMN id, " +
+                       "".join(f"DROP INDEX {key_name}, " for key_name in old_indexes) +
+                       f"ADD PRIMARY KEY ({', '.join(natural_key)})" +
+                       "".join(f", ADD INDEX {key_name} ({', '.join(columns)})" for key_name, columns in indexes.items()))
+
+
+    def insert_sales(self, df_sales, table_name, method=None):
+        method = method or get_load_method()
+        if method == "to_sql":
+            self.insert_sales_to_sql(df_sales, table_name)
+        elif method == "executemany":
+            self.insert_sales_executemany(df_sales, table_name)
+        else:
+            try:
+                self.insert_sales_infile(df_sales, table_name)
+            except Exception as e:
+                # LOAD DATA LOCAL INFILE can be disabled on the server (local_infile=OFF), so fall back to batched INSERTs
+                print(f"---- Warning: {table_name} not bulk loaded, using executemany instead ->\n", e)
+                self.insert_sales_executemany(df_sales, table_name)
+
+
+    def insert_sales_to_sql(self, df_sales, table_name):
+        # Add to bottom of table
+        with self.engine.begin() as conn:
+            # Using chunksize and multi-insert to increase insertion speed.
+            df_sales.to_sql(con=conn, name=table_name, if_exists='append', index=False, chunksize=1000, method='multi')
+
+
+    def insert_sales_infile(self, df_sales, table_name):
+        # Stream the frame to a temp file in MYSQL's default LOAD DATA format, then load it in one statement
+        tmp_file = tempfile.NamedTemporaryFile(mode="w", encoding="utf-8", newline="\n", suffix=".tsv", delete=False)
+        try:
+            with tmp_file:
+                for start in range(0, df_sales.shape[0], get_load_batch_size()):
+                    lines = get_infile_lines(df_sales.iloc[start:start + get_load_batch_size()])
+                    tmp_file.write("\n".join(lines) + "\n")
+            # SQL STMT: Bulk load the temp file (tab separated, \N for NULL)
+            load_data = f"""LOAD DATA LOCAL INFILE %s INTO TABLE {table_name}
+                CHARACTER SET utf8mb4
+                FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'
+                ({', '.join(df_sales.columns)});"""
+            with self.get_cursor() as cursor:
+                cursor.execute(load_data, (tmp_file.name.replace(os.sep, "/"),))
+        finally:
+            os.remove(tmp_file.name)
+
+
+    def insert_sales_executemany(self, df_sales, table_name):
+        # SQL STMT: Insert rows (mysql.connector batches executemany INSERTs into multi-row statements)
+        insert_rows = f"""INSERT INTO {table_name} ({', '.join(df_sales.columns)})
+                          VALUES ({', '.join(['%s'] * df_sales.shape[1])});"""
+        with self.get_cursor() as cursor:
+            for start in range(0, df_sales.shape[0], get_load_batch_size()):
+                cursor.executemany(insert_rows, get_rows(df_sales.iloc[start:start + get_load_batch_size()]))
+
+
+    def create_staging_tables(self):
+        staging_indexes = {}
+        with self.get_cursor() as cursor:
+            for table_name in sales_tables:
+                staging_table = get_table_name(table_name, staging=True)
+                # Start from an empty copy of the live table (left over by a failed load or not)
+                cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+                cursor.execute(f"CREATE TABLE {staging_table} LIKE {table_name}")
+                # Bulk inserts skip secondary index maintenance. The indexes are rebuilt once before the swap.
+                staging_indexes[table_name] = self.drop_secondary_indexes(cursor, staging_table)
+        return staging_indexes
+
+
+    # Drop every index except the primary key and return their definitions, so they can be added back
+    def drop_secondary_indexes(self, cursor, table_name):
+        # SQL STMT: Columns of each index (Non_unique, Key_name, Seq_in_index, Column_name, Sub_part)
+        cursor.execute(f"SHOW INDEX FROM {table_name}")
+        indexes = {}
+        for row in cursor.fetchall():
+            non_unique, key_name, seq_in_index, column_name, sub_part = row[1], row[2], row[3], row[4], row[7]
+            if key_name == 'PRIMARY':
+                continue
+            column = f"{column_name}({sub_part})" if sub_part else column_name
+            indexes.setdefault(key_name, {'unique': not int(non_unique), 'columns': {}})['columns'][seq_in_index] = column
+        if indexes:
+            cursor.execute(f"ALTER TABLE {table_name} " + ", ".join(f"DROP INDEX {key_name}" for key_name in indexes))
+        return {key_name: (index['unique'], [index['columns'][seq] for seq in sorted(index['columns'])])
+                for key_name, index in indexes.items()}
+
+
+    # Rebuild the secondary indexes of the staging tables, then swap them in with a single (atomic) RENAME TABLE
+    def swap_staging_tables(self, staging_indexes):
+        renames = []
+        with self.get_cursor() as cursor:
+            for table_name in sales_tables:
+                staging_table = get_table_name(table_name, staging=True)
+                indexes = staging_indexes.get(table_name, {})
+                if indexes:
+                    # Build all indexes of a table in one pass
+                    cursor.execute(f"ALTER TABLE {staging_table} " +
+                                   ", ".join(f"ADD {'UNIQUE ' if unique else ''}INDEX {key_name} ({', '.join(columns)})"
+                                             for key_name, (unique, columns) in indexes.items()))
+                renames += [f"{table_name} TO {table_name}_old", f"{staging_table} TO {table_name}"]
+            cursor.execute("DROP TABLE IF EXISTS " + ", ".join(f"{table_name}_old" for table_name in sales_tables))
+            # Readers see either the old or the new tables, never an empty or partial one
+            cursor.execute("RENAME TABLE " + ", ".join(renames))
+            cursor.execute("DROP TABLE " + ", ".join(f"{table_name}_old" for table_name in sales_tables))
+
+
+    def update_watermark(self, rows):
+        # SQL STMT: Add or replace the watermark of each loaded sheet
+        upsert_watermark = """REPLACE INTO etl_watermark (sheet_year, content_hash, last_sales_date, loaded_at)
+                              VALUES (%s, %s, %s, %s);"""
+        with self.get_cursor() as cursor:
+            cursor.executemany(upsert_watermark, rows)
+
+
+    def update_data_version(self, data_version, updated_at):
+        # SQL STMT: Replace the data version
+        with self.get_cursor() as cursor:
+            cursor.execute("""REPLACE INTO etl_metadata (meta_key, meta_value, updated_at) VALUES (%s, %s, %s);""",
+                           ('data_version', data_version, updated_at))
+
+
+    def load_source_totals(self, cursor, df_source_totals):
+        # SQL STMT: Temporary table of the source annual totals (only visible to this connection)
+        cursor.execute("""CREATE TEMPORARY TABLE source_annual_sales (
+            year SMALLINT NOT NULL,
+            cat_name VARCHAR(500) NOT NULL,
+            annual_sales DOUBLE NOT NULL,
+            INDEX (year, cat_name));""")
+        cursor.executemany("""INSERT INTO source_annual_sales (year, cat_name, annual_sales) VALUES (%s, %s, %s);""",
+                           get_rows(df_source_totals))
+
+
+    # The connection goes back to the pool, so its temporary table is dropped rather than left for the next user
+    def drop_source_totals(self, cursor):
+        cursor.execute("DROP TEMPORARY TABLE IF EXISTS source_annual_sales")
+
+
+    def get_period_start(self, freq):
+        if freq == "Q":
+            return "MAKEDATE(YEAR(sales_date), 1) + INTERVAL (QUARTER(sales_date) - 1) * 3 MONTH"
+        return "MAKEDATE(YEAR(sales_date), 1)"
+
+
+    def get_row_digest(self, key_col):
+        return f"CAST(CONV(LEFT(MD5({self.get_row_text(key_col)}), 8), 16, 10) AS UNSIGNED)"
+
+
+    # MYSQL rounds the loaded decimal text half away from zero
+    def round_sales(self, sales):
+        return np.sign(sales) * np.floor(np.abs(sales) + 0.5)
+
+
+    def explain(self, query, params):
+        with self.get_cursor() as cursor:
+            cursor.execute("EXPLAIN " + query, params)
+            columns = [col[0] for col in cursor.description]
+            plans = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        # type ALL is a full table scan
+        return [(plan['table'], plan['type'], plan['key'], plan['rows'], plan['type'] == 'ALL') for plan in plans]
+
+
+    def empty_tables(self):
+        with self.get_cursor() as cursor:
+            cursor.execute("TRUNCATE TABLE combined_sales")
+            cursor.execute("TRUNCATE TABLE store_sales")
+            # Databases created before incremental loads and summaries were added may not have these tables
+            for table_name in ['etl_watermark', 'etl_metadata'] + list(summary_tables.values()):
+                cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
+                if cursor.fetchall():
+                    cursor.execute(f"TRUNCATE TABLE {table_name}")
+
+
+    def drop_db(self):
+        with self.get_cursor() as cursor:
+            cursor.execute("DROP DATABASE IF EXISTS mrts")
+        self.engine.dispose()
+
+
+    def drop_tables(self):
+        with self.get_cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS combined_sales")
+            cursor.execute("DROP TABLE IF EXISTS store_sales")
+            cursor.execute("DROP TABLE IF EXISTS etl_watermark, etl_metadata")
+            cursor.execute("DROP TABLE IF EXISTS " + ", ".join(summary_tables.values()))
+            # Left over by a failed full reload
+            cursor.execute("DROP TABLE IF EXISTS combined_sales_staging, store_sales_staging")
+
+
+    def close(self):
+        # Close pooled connections
+        # Source: https://stackoverflow.com/a/51242577/848353
+        self.engine.dispose()
+
+
+# Embedded, file based columnar database for local runs and CI. No server is needed, and
+# aggregations such as the annual totals run in process over columnar storage.
+class DuckDBStorage(Storage):
+    name = "DuckDB"
+    param = "?"
+    # Dates are fetched as datetime64 columns, so they need no conversion
+    series_date = "sales_date"
+
+    def __init__(self):
+        self.db_file = get_db().get('embedded_file', './load/mrts.duckdb')
+        self.connection = None
+        self.connection_lock = threading.Lock()
+
+
+    # One database connection per process. Each operation gets its own cursor (a child connection),
+    # which is how DuckDB shares a database between threads.
+    def connect(self):
+        with self.connection_lock:
+            if self.connection is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.db_file)), exist_ok=True)
+                self.connection = duckdb.connect(self.db_file)
+        cursor = self.connection.cursor()
+        cursor.begin()
+        return cursor, cursor
+
+
+    # The database file is created on first connect
+    def create_db(self):
+        with self.get_cursor() as cursor:
+            pass
+
+
+    def create_tables(self):
+        with self.get_cursor() as cursor:
+            for table_name in sales_tables:
+                cursor.execute(self.get_create_sales_table(table_name, table_name))
+            # SQL STMT: Create load watermark table (one row per loaded workbook sheet)
+            cursor.execute("""CREATE TABLE IF NOT EXISTS etl_watermark (
+                sheet_year SMALLINT NOT NULL PRIMARY KEY,
+                content_hash VARCHAR NOT NULL,
+                last_sales_date DATE NOT NULL,
+                loaded_at TIMESTAMP NOT NULL);""")
+            # SQL STMT: Create load metadata table (the data version of the last load)
+            cursor.execute("""CREATE TABLE IF NOT EXISTS etl_metadata (
+                meta_key VARCHAR NOT NULL PRIMARY KEY,
+                meta_value VARCHAR NOT NULL,
+                updated_at TIMESTAMP NOT NULL);""")
+            for summary_table in summary_tables.values():
+                cursor.execute(self.get_create_summary_table(summary_table))
+
+
+    # SQL STMT: Create a sales table (or its staging table) keyed by its natural key.
+    # Columnar storage prunes scans by sales_date with zone maps, so no secondary indexes are needed.
+    def get_create_sales_table(self, table_name, sales_table):
+        cat_code = "cat_code VARCHAR NOT NULL," if sales_table == 'store_sales' else ""
+        return f"""CREATE TABLE IF NOT EXISTS {table_name} (
+            sales_date DATE NOT NULL,
+            sales INTEGER,
+            cat_name VARCHAR NOT NULL,
+            {cat_code}
+            PRIMARY KEY ({', '.join(sales_keys[sales_table][0])}));"""
+
+
+    # Insert the whole frame in one statement, scanning the DataFrame in place
+    def insert_sales(self, df_sales, table_name, method=None):
+        with self.get_cursor() as cursor:
+            cursor.register("df_sales", df_sales)
+            try:
+                cursor.execute(f"""INSERT INTO {table_name} ({', '.join(df_sales.columns)})
+                                   SELECT {', '.join(df_sales.columns)} FROM df_sales;""")
+            finally:
+                cursor.unregister("df_sales")
+
+
+    def load_source_totals(self, cursor, df_source_totals):
+        cursor.register("df_source_totals", df_source_totals)
+        try:
+            # SQL STMT: Temporary table of the source annual totals (only visible to this connection)
+            cursor.execute("""CREATE TEMP TABLE source_annual_sales AS
+                              SELECT CAST(year AS SMALLINT) AS year, CAST(cat_name AS VARCHAR) AS cat_name,
+                                     CAST(annual_sales AS DOUBLE) AS annual_sales
+                              FROM df_source_totals;""")
+        finally:
+            cursor.unregister("df_source_totals")
+
+
+    def drop_source_totals(self, cursor):
+        cursor.execute("DROP TABLE IF EXISTS temp.source_annual_sales")
+
+
+    def get_row_digest(self, key_col):
+        return f"CAST('0x' || LEFT(MD5({self.get_row_text(key_col)}), 8) AS UBIGINT)"
+
+
+    # DuckDB returns the result as columns, so no rows are built
+    def read_series(self, table_name, keys, start=None, end=None, freq="M"):
+        query, params = self.get_series_query(table_name, keys, start, end, freq)
+        with self.get_cursor() as cursor:
+            cursor.execute(query, params)
+            arrays = list(cursor.fetchnumpy().values())
+        # Missing months are masked
+        return [np.asarray(arrays[0]).astype("datetime64[ns]")] + \
+               [np.ma.filled(np.ma.asarray(array).astype("float64"), np.nan) for array in arrays[1:]]
+
+
+    def get_period_start(self, freq):
+        return f"CAST(DATE_TRUNC('{'quarter' if freq == 'Q' else 'year'}', sales_date) AS DATE)"
+
+
+    # DuckDB rounds half to even when a float is cast to INTEGER
+    def round_sales(self, sales):
+        return np.round(sales)
+
+
+    def create_staging_tables(self):
+        with self.get_cursor() as cursor:
+            for table_name in sales_tables:
+                staging_table = get_table_name(table_name, staging=True)
+                # Start from an empty staging table (left over by a failed load or not)
+                cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+                cursor.execute(self.get_create_sales_table(staging_table, table_name))
+
+
+    # DDL is transactional, so both tables are swapped in one commit
+    def swap_staging_tables(self, staging_state):
+        with self.get_cursor() as cursor:
+            for table_name in sales_tables:
+                cursor.execute(f"DROP TABLE {table_name}")
+                cursor.execute(f"ALTER TABLE {get_table_name(table_name, staging=True)} RENAME TO {table_name}")
+
+
+    def update_watermark(self, rows):
+        # SQL STMT: Add or replace the watermark of each loaded sheet
+        with self.get_cursor() as cursor:
+            cursor.executemany("""INSERT OR REPLACE INTO etl_watermark (sheet_year, content_hash, last_sales_date, loaded_at)
+                                  VALUES (?, ?, ?, ?);""", rows)
+
+
+    def update_data_version(self, data_version, updated_at):
+        # SQL STMT: Replace the data version
+        with self.get_cursor() as cursor:
+            cursor.execute("""INSERT OR REPLACE INTO etl_metadata (meta_key, meta_value, updated_at) VALUES (?, ?, ?);""",
+                           ('data_version', data_version, updated_at))
+
+
+    def empty_tables(self):
+        with self.get_cursor() as cursor:
+            for table_name in sales_tables + ['etl_watermark', 'etl_metadata'] + list(summary_tables.values()):
+                cursor.execute(f"DELETE FROM {table_name}")
+
+
+    # The database is a file, so dropping it removes the file
+    def drop_db(self):
+        self.close()
+        for db_file in [self.db_file, self.db_file + ".wal"]:
+            if os.path.exists(db_file):
+                os.remove(db_file)
+
+
+    def drop_tables(self):
+        with self.get_cursor() as cursor:
+            for table_name in sales_tables + [get_table_name(table_name, staging=True) for table_name in sales_tables] + \
+                              ['etl_watermark', 'etl_metadata'] + list(summary_tables.values()):
+                cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+
+
+    def close(self):
+        with self.connection_lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+# Format rows as tab separated text, escaping the characters LOAD DATA treats as special
+def get_infile_lines(df_sales):
+    fields = []
+    for col in df_sales.columns:
+        values = df_sales[col]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            text = values.dt.strftime("%Y-%m-%d")
+        elif pd.api.types.is_numeric_dtype(values):
+            text = values.astype(str)
+        else:
+            text = values.astype(str).str.replace("\\", "\\\\", regex=False) \
+                                     .str.replace("\t", "\\t", regex=False) \
+                                     .str.replace("\n", "\\n", regex=False)
+        # \N is NULL in LOAD DATA
+        fields.append(text.where(values.notna(), "\\N").astype(str))
+    return fields[0].str.cat(fields[1:], sep="\t")
+
+
+# Rows as tuples of Python values (dates, floats, str and None), which mysql.connector can convert
+def get_rows(df_sales):
+    columns = []
+    for col in df_sales.columns:
+        values = df_sales[col]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = values.dt.date
+        elif pd.api.types.is_numeric_dtype(values):
+            values = values.astype("float64")
+        columns.append(values.astype(object).where(values.notna(), None).tolist())
+    return list(zip(*columns))
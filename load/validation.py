@@ -1,23 +1,35 @@
 
 from time import perf_counter
 import sys
+import hashlib
 import pandas as pd
 import numpy as np
 
-from transform.clean import Clean
+from transform.clean import Clean, get_years
 import load.manage_db as manage_db
-from extract.get_sales_df import GetSalesDF
+import load.storage as storage
 
-def validate_all(df_all_sales):
-    validate_combined_record_count(df_all_sales['df_combined'].shape[0])
-    validate_store_record_count(df_all_sales["orig_store_record_count"], df_all_sales["dropped_record_count"])
-    validate_totals(df_all_sales['df_annual'])
+# Mismatching checksum buckets whose rows are compared one by one
+MAX_DRILL_DOWN = 10
 
+# Validate all years, or only the given years (used by the incremental load)
+# Without cleaned sales, they come from the process-wide extraction session shared with Clean
+# With staging, the staging tables of a full reload are validated before they are swapped in
+def validate_all(df_all_sales=None, years=None, staging=False):
+    if df_all_sales is None:
+        df_all_sales = Clean().get_all_sales(years)
+    validate_combined_record_count(df_all_sales['df_combined'].shape[0], years, staging)
+    validate_store_record_count(df_all_sales["orig_store_record_count"], df_all_sales["dropped_record_count"], years, staging)
+    # Catches swapped months or duplicated rows that keep the counts and annual sums equal
+    validate_checksums(df_all_sales['df_combined'], 'combined_sales', 'cat_name', years, staging)
+    validate_checksums(df_all_sales['df_store'], 'store_sales', 'cat_code', years, staging)
+    validate_totals(df_all_sales['df_annual'], years, staging)
 
-def validate_combined_record_count(count_source_combined):
+
+def validate_combined_record_count(count_source_combined, years=None, staging=False):
     start_time = perf_counter()
     # Verify accuracy of combined_sales db insertion
-    count_db_combined  = manage_db.read_combined_sales_count()
+    count_db_combined  = manage_db.read_combined_sales_count(years, staging)
     # Notify user
     msg_combined_no_var = f"""Completed: The combined_sales records in the database ({count_db_combined}) 
     equals the combined_sales in the source data ({count_source_combined}). 
@@ -31,10 +43,10 @@ def validate_combined_record_count(count_source_combined):
         sys.exit(1)
 
 
-def validate_store_record_count(count_source_store_records, count_source_store_nans):
+def validate_store_record_count(count_source_store_records, count_source_store_nans, years=None, staging=False):
     start_time = perf_counter()
     # Verify accuracy of store_sales db insertion
-    count_db_store = manage_db.read_store_sales_count()
+    count_db_store = manage_db.read_store_sales_count(years, staging)
     # Notify user
     msg_store_no_var = f"""Completed: The store_sales records in the database ({count_db_store}) 
     equals the store_sales in the source data ({count_source_store_records}) less the nan rows removed ({count_source_store_nans}). 
@@ -48,13 +60,87 @@ def validate_store_record_count(count_source_store_records, count_source_store_n
         sys.exit(1)
 
 
-def validate_totals(df_source_totals):
+# Compare the rows of source and db with a checksum per (key, year) bucket. The buckets are compared in one pass,
+# then only the rows of the mismatching buckets are read back to find the rows that differ.
+def validate_checksums(df_sales, table_name, key_col, years=None, staging=False):
+    start_time = perf_counter()
+    # Only the rows of the given years are compared (and hashed), like the db buckets read back
+    df_sales = get_years(df_sales, years)
+    row_texts = get_row_texts(df_sales, key_col)
+    df_source_checksums = get_source_checksums(df_sales, key_col, row_texts)
+    db_checksums = manage_db.read_sales_checksums(table_name, key_col, years, staging)
+    print(f"Processing: validating {table_name} checksums between source and db")
+    df_db_checksums = pd.DataFrame(db_checksums, columns=[key_col, "year", "row_count", "digest"]) \
+                        .astype({key_col: str, "year": "int64", "row_count": "int64", "digest": "int64"})
+    df_merge = pd.merge(df_source_checksums, df_db_checksums, on=[key_col, "year"], suffixes=("_source", "_db"), how="outer")
+    # Buckets missing on either side have nan counts, so they differ too
+    is_var = (df_merge["row_count_source"] != df_merge["row_count_db"]) | (df_merge["digest_source"] != df_merge["digest_db"])
+    df_vars = df_merge[is_var].sort_values([key_col, "year"])
+    if df_vars.empty:
+        print(f"""Completed: the {table_name} rows in the database match the source data ({'{:,}'.format(df_merge.shape[0])} buckets). 
+                Validated in {round(perf_counter()-start_time,4)} seconds.""")
+    else:
+        print(f"---- Variance: {df_vars.shape[0]} of {df_merge.shape[0]} ({key_col}, year) buckets differ between source and db in {table_name}")
+        print_bucket_variances(df_sales, row_texts, df_vars.head(MAX_DRILL_DOWN), table_name, key_col, staging)
+        sys.exit(1)
+
+
+# Source rows as the "key|YYYY-MM-DD|sales" text hashed by the database (see load.storage.Storage.get_row_text)
+def get_row_texts(df_sales, key_col):
+    sales = storage.get_storage().round_sales(df_sales["sales"].to_numpy(dtype="float64", na_value=np.nan))
+    is_na = np.isnan(sales)
+    sales_text = pd.Series(np.where(is_na, 0, sales).astype("int64"), index=df_sales.index).astype(str).where(~is_na, "")
+    return df_sales[key_col].astype(str) + "|" + df_sales["sales_date"].dt.strftime("%Y-%m-%d") + "|" + sales_text
+
+
+# Row count and sum of the row digests of each (key, year) bucket, computed like load.storage.Storage.read_sales_checksums.
+# The rows are hashed in one query of an in-memory DuckDB, or one row at a time without the duckdb package.
+def get_source_checksums(df_sales, key_col, row_texts):
+    df_rows = pd.DataFrame({key_col: df_sales[key_col].astype(str).to_numpy(),
+                            "year": df_sales["sales_date"].dt.year.to_numpy().astype("int64"),
+                            "row": row_texts.array})
+    if storage.duckdb is not None:
+        with storage.duckdb.connect() as con:
+            con.register("source_rows", df_rows)
+            # Same digest as load.storage.DuckDBStorage.get_row_digest, over the row texts built from the source
+            return con.execute(f"""SELECT {key_col}, year, COUNT(*) AS row_count,
+                                          CAST(SUM(CAST('0x' || LEFT(MD5(row), 8) AS UBIGINT)) AS BIGINT) AS digest
+                                   FROM source_rows
+                                   GROUP BY {key_col}, year;""").df()
+    df_rows["digest"] = [int(hashlib.md5(row_text.encode("utf-8")).hexdigest()[:8], 16) for row_text in df_rows["row"]]
+    return df_rows.groupby([key_col, "year"], sort=False).agg(row_count=("digest", "size"), digest=("digest", "sum")).reset_index()
+
+
+# Print the rows of the mismatching buckets that are only in the source or only in the database
+def print_bucket_variances(df_sales, row_texts, df_vars, table_name, key_col, staging=False):
+    buckets = [(key, int(year)) for key, year in zip(df_vars[key_col], df_vars["year"])]
+    df_buckets = pd.DataFrame(buckets, columns=[key_col, "year"])
+    df_source_rows = pd.DataFrame({key_col: df_sales[key_col].astype(str).to_numpy(),
+                                   "year": df_sales["sales_date"].dt.year.to_numpy().astype("int64"),
+                                   "row": row_texts.to_numpy()}).merge(df_buckets, on=[key_col, "year"])
+    df_db_rows = pd.DataFrame(manage_db.read_sales_buckets(table_name, key_col, buckets, staging), 
+                              columns=[key_col, "year", "row"]).astype({key_col: str, "year": "int64"})
+    # Number repeated rows, so a duplicated row is matched once and its copy is reported
+    for df_rows in [df_source_rows, df_db_rows]:
+        df_rows["copy"] = df_rows.groupby("row").cumcount()
+    df_rows = pd.merge(df_source_rows, df_db_rows, on=[key_col, "year", "row", "copy"], how="outer", indicator=True)
+    df_rows = df_rows[df_rows["_merge"] != "both"].sort_values([key_col, "year", "row"])
+    df_rows["found_in"] = df_rows["_merge"].map({"left_only": "source only", "right_only": "db only"})
+    print(f"The differing rows of the first {len(buckets)} bucket(s) are as follows:")
+    print(df_rows[["row", "found_in"]].to_string(index=False))
+
+
+def validate_totals(df_source_totals, years=None, staging=False):
+    # "database" reconciles in SQL and only returns the variances, "pandas" compares every total in memory
+    if storage.get_db().get('totals_reconciliation', 'database') == "database":
+        return validate_totals_in_db(df_source_totals, years, staging)
     start_time = perf_counter()
     # Get annual totals from census.gov
-    df_source_totals.sort_values(['year', 'cat_name'], ascending=[True, True], inplace=True)
+    # Sort a copy, since the source frame may be shared with the extraction session
+    df_source_totals = df_source_totals.sort_values(['year', 'cat_name'], ascending=[True, True])
     # Get totals from database
     df_db_totals = pd.DataFrame(columns=["year", "cat_name", "annual_sales"])
-    db_totals = manage_db.read_calc_annual_sales()
+    db_totals = manage_db.read_calc_annual_sales(years, staging)
     print('Processing: validating annual sales between source and db (excluding effects of nans)')
     # Add list of tuples to dataframe Source: https://stackoverflow.com/a/48220676/848353
     df_db_totals[["year", "cat_name", "annual_sales"]] = pd.DataFrame(db_totals)
@@ -74,4 +160,19 @@ def validate_totals(df_source_totals):
         print(f"---- Variance: there are {count_var} variance(s) in annual sales between source and db\nThe variances are as follows:")
         df_vars = df_merge[df_merge["match"] == True]
         print(df_vars.iloc[:,0:4])
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+
+
+# Load the source totals into a temporary table and compare them with the db totals in one join,
+# so only the variances cross the wire
+def validate_totals_in_db(df_source_totals, years=None, staging=False):
+    start_time = perf_counter()
+    variances = manage_db.read_annual_sales_variances(df_source_totals, years, staging)
+    print('Processing: validating annual sales between source and db (excluding effects of nans)')
+    if not variances:
+        print(f"""Completed: no variance in annual sales between source and db (excluding effects of nans). 
+                Validated in {round(perf_counter()-start_time,4)} seconds.""")
+    else: 
+        print(f"---- Variance: there are {len(variances)} variance(s) in annual sales between source and db\nThe variances are as follows:")
+        print(pd.DataFrame(variances, columns=["year", "cat_name", "annual_sales_source", "annual_sales_db"]))
+        sys.exit(1)
@@ -0,0 +1,83 @@
+import os
+import random
+import openpyxl
+import pytest
+import extract.workbook_cache as workbook_cache
+import extract.snapshot as snapshot
+import extract.session as session
+import load.storage as storage
+import load.manage_db as manage_db
+
+# The modules read their config files relative to the project root
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORE_CODES = [f"44{i}" for i in range(10, 68)]
+
+
+# Synthetic workbook with the census.gov layout: one sheet per year, newest (in progress) first, each with
+# 7 combined rows and 58 store rows. Store rows have random runs of "(NA)"/"(S)" months, some long enough to span years.
+# edit_months {year: [months]} doubles those months of every store row that has sales (and updates its total).
+def make_workbook(path, seed=1, last_year=2022, edit_months=None):
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for year in range(last_year, last_year - 30, -1):
+        sheet = workbook.create_sheet(str(year))
+        sheet.append(["ESTIMATED MONTHLY SALES"] + [None] * 14)
+        for _ in range(4):
+            sheet.append([None] * 15)
+        sheet.append(["NAICS", "Kind of Business"] + [f"{month}. {year}" for month in range(1, 13)] + ["TOTAL"])
+        for row_num in range(7):
+            sales = [rng.randint(100000, 500000) for _ in range(12)]
+            cat_name = f"Retail combined {row_num}" if row_num else "Retail and food services sales, total"
+            sheet.append([None, cat_name] + sales + [sum(sales)])
+        for row_num, cat_code in enumerate(STORE_CODES):
+            sales = [rng.randint(100, 9000) for _ in range(12)]
+            nans = rng.choice([0, 0, 0, 0, 1, 2, 3, 4, 5, 12])
+            if cat_code in ("4420", "4421") and year < 2000:
+                nans = 12
+            for month in rng.sample(range(12), nans):
+                sales[month] = rng.choice(["(NA)", "(S)"])
+            for month in (edit_months or {}).get(year, []):
+                if isinstance(sales[month - 1], int):
+                    sales[month - 1] *= 2
+            total = sum(sales) if nans == 0 else "(NA)"
+            # NAICS codes come as numbers and as text
+            sheet.append([int(cat_code) if row_num % 3 else cat_code, f"Store {cat_code}"] + sales + [total])
+        sheet.append([None, "ADJUSTED(2)"] + [None] * 13)
+        sheet.append([None, "footnote"] + [None] * 13)
+    workbook.save(path)
+    return str(path)
+
+
+# Run ETL steps against a workbook and a DuckDB file in tmp_path, with fresh process-wide state for each run
+@pytest.fixture
+def mrts(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO_DIR)
+    monkeypatch.setattr(snapshot, "snapshot_dir", str(tmp_path / "snapshots"))
+    db = dict(storage.get_db(), backend="duckdb", result_cache_max_mb=0)
+    monkeypatch.setattr(storage, "db", db)
+
+    def use(workbook_path, db_name):
+        if storage.storage is not None:
+            storage.storage.close()
+        monkeypatch.setenv("MRTS_WORKBOOK", str(workbook_path))
+        monkeypatch.setattr(workbook_cache, "workbook_path", None)
+        monkeypatch.setattr(session, "sessions", {})
+        monkeypatch.setattr(storage, "storage", None)
+        monkeypatch.setattr(manage_db, "data_version", None)
+        db['embedded_file'] = str(tmp_path / f"{db_name}.duckdb")
+
+    yield use
+    if storage.storage is not None:
+        storage.storage.close()
+
+
+# Every sales and summary table of the current database, sorted by its key
+def read_tables():
+    tables = {}
+    with storage.get_storage().get_cursor() as cursor:
+        for table_name in storage.sales_tables + list(storage.summary_tables.values()):
+            cursor.execute(f"SELECT * FROM {table_name}")
+            df = cursor.fetchdf()
+            tables[table_name] = df.sort_values(list(df.columns)).reset_index(drop=True)
+    return tables
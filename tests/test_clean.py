@@ -0,0 +1,28 @@
+import pandas as pd
+import pytest
+import transform.clean as clean
+from tests.conftest import make_workbook
+
+
+# Rows in key order, with categories as plain values (a streamed year only holds its own categories)
+def sort_sales(df):
+    df = df.astype({column: str for column in df.select_dtypes("category").columns})
+    return df.sort_values(["cat_code", "sales_date"] if "cat_code" in df.columns else list(df.columns)).reset_index(drop=True)
+
+
+# Streamed years are cleaned with only a few neighbouring years in memory,
+# but must fill every nan with the same value as cleaning all years at once
+@pytest.mark.parametrize("seed", [1, 2])
+@pytest.mark.parametrize("interpolation", ["linear", "time", "seasonal"])
+def test_streamed_years_equal_full_clean(mrts, tmp_path, interpolation, seed):
+    workbook = make_workbook(tmp_path / "mrts.xlsx", seed=seed)
+    mrts(workbook, "clean")
+    cleaner = clean.Clean(interpolation=interpolation)
+    dict_full = cleaner.get_all_sales()
+    streamed_years = list(clean.Clean(interpolation=interpolation).iter_clean_years([workbook]))
+
+    assert [int(dict_year['df_sheets'].year.iloc[0]) for dict_year in streamed_years] == list(range(2021, 1992, -1))
+    for name in ['df_combined', 'df_store', 'df_annual']:
+        df_streamed = pd.concat([dict_year[name] for dict_year in streamed_years])
+        pd.testing.assert_frame_equal(sort_sales(df_streamed), sort_sales(dict_full[name]), obj=name)
+    assert sum(dict_year['dropped_record_count'] for dict_year in streamed_years) == dict_full['dropped_record_count']
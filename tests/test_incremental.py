@@ -0,0 +1,25 @@
+import pandas as pd
+import pytest
+import load.manage_db as manage_db
+from tests.conftest import make_workbook, read_tables
+
+
+# Changing the first and last month of a year changes nans filled in the years around it,
+# so an incremental load must store the same tables as a full load of the changed workbook
+@pytest.mark.parametrize("interpolation", ["linear", "time", "seasonal"])
+def test_incremental_load_equals_full_load(mrts, tmp_path, interpolation):
+    workbook = make_workbook(tmp_path / "mrts.xlsx")
+    changed_workbook = make_workbook(tmp_path / "mrts_changed.xlsx", edit_months={2015: [1, 12]})
+
+    mrts(changed_workbook, "full")
+    manage_db.insert_all_sales(interpolation=interpolation)
+    full_tables = read_tables()
+
+    mrts(workbook, "incremental")
+    manage_db.insert_all_sales(interpolation=interpolation)
+    mrts(changed_workbook, "incremental")
+    manage_db.insert_new_sales(interpolation=interpolation)
+    incremental_tables = read_tables()
+
+    for table_name, df_full in full_tables.items():
+        pd.testing.assert_frame_equal(incremental_tables[table_name], df_full, obj=table_name)
@@ -0,0 +1,16 @@
+import pandas as pd
+import load.manage_db as manage_db
+from tests.conftest import make_workbook
+
+
+# Annual totals are read from the summary table, labelled by year end like monthly sales grouped by year
+def test_annual_series_equal_grouped_months(mrts, tmp_path):
+    mrts(make_workbook(tmp_path / "mrts.xlsx"), "read_series")
+    manage_db.insert_all_sales()
+    categories = {"sales": "Retail and food services sales, total", "other": "Retail combined 1"}
+    df_monthly = manage_db.read_series(categories, table_name="combined_sales").set_index("sales_date")
+    df_annual = manage_db.read_annual_series(categories, end="2020-01-01", table_name="combined_sales")
+    df_monthly = df_monthly[df_monthly.index < "2020-01-01"]
+    df_grouped = df_monthly.groupby(df_monthly.index.year).sum()
+    assert list(df_annual.index) == [pd.Timestamp(f"{year}-12-31") for year in df_grouped.index]
+    assert df_annual.to_numpy().tolist() == df_grouped.to_numpy().tolist()
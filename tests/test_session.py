@@ -0,0 +1,22 @@
+import pandas as pd
+import extract.session as session
+import extract.snapshot as snapshot
+from tests.conftest import make_workbook
+
+
+# Frames derived one at a time from the parsed sheets equal those of a full extraction with workers,
+# and each (workers, rebuild) pair gets its own session
+def test_lazy_frames_equal_worker_extraction(mrts, tmp_path):
+    mrts(make_workbook(tmp_path / "mrts.xlsx"), "session")
+    lazy_session = session.get_session()
+    df_store = lazy_session.get_store_sales()
+    assert list(lazy_session.frames) == ['df_store']
+    assert session.get_session() is lazy_session
+
+    worker_session = session.get_session(workers=2, rebuild=True)
+    assert worker_session is not lazy_session
+    dict_lazy, dict_workers = lazy_session.get_all_sales(), worker_session.get_all_sales()
+    assert dict_lazy['df_store'] is df_store
+    for name in snapshot.frame_names:
+        pd.testing.assert_frame_equal(dict_lazy[name].reset_index(drop=True), dict_workers[name].reset_index(drop=True), obj=name)
+        pd.testing.assert_frame_equal(snapshot.load_frame(name).reset_index(drop=True), dict_lazy[name].reset_index(drop=True), obj=name)
@@ -0,0 +1,39 @@
+import io
+import os
+import urllib.request
+import pytest
+import extract.workbook_cache as workbook_cache
+
+
+# A download that fails after its first block
+class BrokenResponse(io.BytesIO):
+
+    def read(self, size=-1):
+        if self.tell() > 0:
+            raise ConnectionResetError("connection reset")
+        return super().read(4)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setitem(workbook_cache.source, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(workbook_cache, "manifest_path", str(tmp_path / "manifest.yaml"))
+    monkeypatch.setattr(urllib.request, "urlopen", lambda request: BrokenResponse(b"partial workbook"))
+    return tmp_path
+
+
+# A failed download falls back to the stale cached copy and leaves no temp file behind
+def test_failed_download_uses_stale_copy(cache_dir):
+    (cache_dir / "abc.xls").write_bytes(b"old workbook")
+    manifest = {workbook_cache.source['url']: {'sha256': "abc", 'file': "abc.xls", 'size': 12,
+                                               'fetched_at': "2020-01-01T00:00:00"}}
+    workbook_cache.write_manifest(manifest)
+    assert workbook_cache.get_cached_workbook() == (os.path.join(str(cache_dir), "abc.xls"), "abc")
+    assert sorted(os.listdir(cache_dir)) == ["abc.xls", "manifest.yaml"]
+
+
+# Without a cached copy, a failed download stops the run
+def test_failed_download_without_copy_exits(cache_dir):
+    with pytest.raises(SystemExit):
+        workbook_cache.get_cached_workbook()
+    assert os.listdir(cache_dir) == []
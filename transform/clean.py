@@ -1,60 +1,136 @@
 
 from time import perf_counter
+import numpy as np
 import pandas as pd
 import extract.get_sales_df as sales_dfs
+import extract.session as session
+from extract.schema import apply_schema, STORE_SCHEMA
 import transform.eval_nans as eval_nans
+import transform.interpolate as interpolate
 import sys
 
 class Clean:
 
-    def __init__(self):
+    def __init__(self, workers=1, rebuild=False, interpolation="linear"):
+        # Number of processes used to extract the workbook sheets
+        self.workers = workers
+        # Ignore any saved snapshot and extract from the workbook again
+        self.rebuild = rebuild
+        # Method used to fill store sales nans (see transform.interpolate.METHODS)
+        self.interpolation = interpolation
         self.df_combined = None
         self.df_store = None
         self.orig_store_record_count = None
         self.dropped_record_count = None
         self.evals = None
+        # Process-wide extraction session, so every Clean instance shares the sheets parsed once
+        self.session = session.get_session(workers, rebuild)
 
 
-    def get_all_sales(self):
-        start_time = perf_counter()
+    # Uncleaned sales dataframes for every year in the workbook
+    def get_source_sales(self):
         # Increase efficieny by accessing all source data at the same time
-        print("Processing: retrieving all sales data from census.gov")
-        # Get all sales dataframes
-        dict_all_sales =  sales_dfs.GetSalesDF('all_sales').get_all_sales_df()
-        self.df_combined = dict_all_sales['df_combined']
+        return self.session.get_all_sales()
+
+
+    # Clean all years, or only the given years (used by the incremental load). The nans of the given years
+    # are filled from the months of every year, so they get the same values as in a full load.
+    def get_all_sales(self, years=None):
+        return self.clean_sales(self.get_source_sales(), years)
+
+
+    # Years besides the given (changed) years whose filled store sales can depend on months of the given years
+    # (usually the year before and after, more across long gaps), so an incremental load reloads them too
+    def get_dependent_years(self, years):
+        df_store = self.get_source_sales()['df_store'].reset_index(drop=True)
+        df_interpolate = eval_nans.EvalNames(df_store).df_nans_interpolate
+        if df_interpolate.empty:
+            return []
+        is_fill = get_fill_mask(df_store, df_interpolate)
+        first_months, last_months = interpolate.get_source_months(df_store, is_fill, self.interpolation)
+        first_years = first_months.astype('datetime64[Y]').astype('int64') + 1970
+        last_years = last_months.astype('datetime64[Y]').astype('int64') + 1970
+        # A filled value depends on the given years when one of them falls within its source months
+        sorted_years = np.array(sorted(years))
+        pos = np.searchsorted(sorted_years, first_years).clip(0, len(sorted_years) - 1)
+        is_dependent = (sorted_years[pos] >= first_years) & (sorted_years[pos] <= last_years)
+        fill_years = df_store.sales_date.dt.year.to_numpy()[is_fill]
+        return sorted({int(year) for year in fill_years[is_dependent]} - set(years))
+
+
+    # Yield one cleaned year at a time from one or more workbooks (newest year first). Each year's nans are filled
+    # from the same months as in a full load: the whole year after it, the earliest month with sales of each
+    # category in the later years, and the earlier years read ahead until every category to interpolate has an
+    # earlier month with sales. Only those years (usually one) are held in memory besides the year being cleaned.
+    def iter_clean_years(self, workbooks=None):
+        # Extracted years not cleaned yet, newest first
+        pending = []
+        # The last cleaned year and the earliest month with sales of each category in the years after it
+        newer_year, df_newer_sales = None, None
+        for dict_year_sales in sales_dfs.GetSalesDF(None).iter_sales_years(workbooks):
+            pending.append(dict_year_sales)
+            while len(pending) > 1 and has_earlier_sales(pending):
+                newer_year, df_newer_sales = yield from self.clean_next_year(pending, newer_year, df_newer_sales)
+        while pending:
+            newer_year, df_newer_sales = yield from self.clean_next_year(pending, newer_year, df_newer_sales)
+
+
+    # Years of each streamed workbook, checked before streaming starts (see GetSalesDF.get_workbook_years)
+    def get_stream_years(self, workbooks=None):
+        return sales_dfs.GetSalesDF(None).get_workbook_years(workbooks)
+
+
+    # Clean the newest pending year, then return what the next year needs from it
+    def clean_next_year(self, pending, newer_year, df_newer_sales):
+        dict_year_sales = pending.pop(0)
+        year = int(dict_year_sales['df_sheets'].year.iloc[0])
+        df_stores = [df for df in [df_newer_sales, newer_year['df_store'] if newer_year else None] if df is not None] + \
+                    [dict_year_sales['df_store']] + [dict_pending['df_store'] for dict_pending in pending]
+        yield self.clean_sales({**dict_year_sales, 'df_store': pd.concat(df_stores)}, [year])
+        if newer_year is not None:
+            # The last cleaned year is earlier than every year already summarized, so its months come first
+            df_newer_sales = get_earliest_sales(pd.concat([df for df in [newer_year['df_store'], df_newer_sales] if df is not None]))
+        return dict_year_sales, df_newer_sales
+
+
+    # Clean the store sales of extracted sales dataframes. With years, every store month is used to fill
+    # the nans, then only the rows of those years are kept (and counted).
+    def clean_sales(self, dict_all_sales, years=None):
+        self.df_combined = get_years(dict_all_sales['df_combined'], years)
         self.df_store = dict_all_sales['df_store']
-        print("Completed: retrieved all sales data from census.gov in ", round(perf_counter()-start_time,4), " seconds.")  
 
         # Clean store dataframe
         self.evals = eval_nans.EvalNames(self.df_store)
         self.show_store_nans()
-        self.remove_store_nan_dfs()
+        self.remove_store_nan_dfs(years)
         return {'df_combined':self.df_combined, 
                 'df_store':self.df_store, 
-                'df_annual':dict_all_sales['df_annual'],
+                'df_annual':get_years(dict_all_sales['df_annual'], years),
+                'df_sheets':get_years(dict_all_sales['df_sheets'], years),
                 'orig_store_record_count':self.orig_store_record_count,
                 'dropped_record_count':self.dropped_record_count}
 
 
     def get_combined_sales(self): 
-        if self.df_combined == None:
+        if self.df_combined is None:
             start_time = perf_counter()
             print("Processing: retrieving combined_sales data from census.gov")
-            self.df_combined = sales_dfs.GetSalesDF("combined_sales").df_combined_sales
+            self.df_combined = self.session.get_combined_sales()
             print("Completed: retrieved combined_sales data from census.gov in ", round(perf_counter()-start_time,4), " seconds.")  
         return self.df_combined
 
 
     def get_cleaned_store_sales(self):
-        if self.df_store == None:   
+        if self.df_store is None:   
             start_time = perf_counter() 
             print("Processing: retrieving store_sales data from census.gov")
-            self.df_store = sales_dfs.GetSalesDF("store_sales").df_store_sales
+            self.df_store = self.session.get_store_sales()
             print("Completed: retrieved store_sales data from census.gov in ", round(perf_counter()-start_time,4), " seconds.")  
 
-        self.evals = eval_nans.EvalNames(self.df_store)
-        self.show_store_nans()
-        self.remove_store_nan_dfs()
+            # Clean once, later calls return the cleaned store sales
+            self.evals = eval_nans.EvalNames(self.df_store)
+            self.show_store_nans()
+            self.remove_store_nan_dfs()
         return self.df_store
 
 
@@ -63,27 +139,38 @@ class Clean:
         print(self.evals.msg_cat_code_year_nans)
        
 
-    def remove_store_nan_dfs(self):
+    def remove_store_nan_dfs(self, years=None):
         start_time = perf_counter()
         # Notify user of status
         print(f"Processing: dropping or interpolating all nans")
 
+        # Rows are matched on their (cat_code, sales_date) key
+        self.df_store = self.df_store.reset_index(drop=True)
+        cat_codes = self.df_store['cat_code'].astype('category').cat.categories
+        store_keys = get_store_keys(self.df_store, cat_codes)
+        is_kept_year = get_years_mask(self.df_store, years)
+
         # Used to do quick check of expected record removal
-        self.orig_store_record_count = self.df_store.shape[0]
-        expected_records_interpolated = self.evals.count_interpolations
-   
-        # Interpolate grouped nan dataframe then merge with df_store if it has between (1-3) nans per year
-        df_interpolated = self.evals.df_nans_interpolate.interpolate()
-        # Match the interpolated values with the df_store dataframe based on the same cat_code, cat_name, and sales_date
-        self.df_store = self.df_store.merge(df_interpolated, how='left', left_on=['cat_code', 'cat_name','sales_date'],
-                                            right_on=['cat_code', 'cat_name','sales_date'])
-        # Merge the two sales columns into one new column, then drop extra columns
-        self.df_store ['sales'] = self.df_store['sales_x'].where(self.df_store['sales_x'].notnull(), self.df_store['sales_y'])    
-        self.df_store.drop(['sales_x','sales_y'],axis=1, inplace=True)
+        self.orig_store_record_count = int(is_kept_year.sum())
+        expected_records_interpolated = 0
+
+        # Interpolate df_store's nans within each cat_code if their group has between (1-3) nans per year
+        # (a single streamed year may have no groups to interpolate or drop)
+        if not self.evals.df_nans_interpolate.empty:
+            is_fill = get_fill_mask(self.df_store, self.evals.df_nans_interpolate, cat_codes, store_keys)
+            self.df_store['sales'] = interpolate.interpolate_sales(self.df_store, is_fill, self.interpolation)
+            expected_records_interpolated = int((is_fill & is_kept_year).sum())
 
         # Remove grouped nan dataframes from df_store if they contain too many nans (>3) by year to be interpolated 
         df_dropped = self.evals.df_nans_drop
-        self.df_store = pd.concat([self.df_store, df_dropped, df_dropped]).drop_duplicates(keep=False)
+        if not df_dropped.empty:
+            # Anti-join: keep the store rows whose key is not in the dropped groups
+            is_kept_year = is_kept_year & ~store_keys.isin(get_store_keys(df_dropped, cat_codes))
+        # The other years only served as neighbouring months for the interpolation
+        df_dropped = get_years(df_dropped, years)
+        self.df_store = self.df_store[is_kept_year]
+        # Keep the compact extract schema for the load stage
+        self.df_store = apply_schema(self.df_store, STORE_SCHEMA)
 
         # Quick check that the correct number of records were removed
         self.dropped_record_count = df_dropped.shape[0]
@@ -99,3 +186,46 @@ class Clean:
                         record removal vary by {record_removal_diff}""")
             sys.exit(1)
 
+
+# True when every category with nans to interpolate in the newest pending year has sales in an earlier pending year
+def has_earlier_sales(pending):
+    df_interpolate = eval_nans.EvalNames(pending[0]['df_store']).df_nans_interpolate
+    if df_interpolate.empty:
+        return True
+    df_earlier = pd.concat([dict_pending['df_store'] for dict_pending in pending[1:]])
+    codes_with_sales = set(df_earlier.cat_code[df_earlier.sales.notna()].astype(str))
+    return set(df_interpolate.cat_code.astype(str)) <= codes_with_sales
+
+
+# The earliest month with sales of each cat_code
+def get_earliest_sales(df_store):
+    df_sales = df_store[df_store.sales.notna()]
+    return df_sales.sort_values("sales_date", kind="mergesort").drop_duplicates("cat_code")
+
+
+# Rows of a frame in the given years (every row when years is None): monthly frames by sales_date, the others by year
+def get_years_mask(df, years):
+    if years is None:
+        return np.ones(df.shape[0], dtype=bool)
+    return (df.sales_date.dt.year if 'sales_date' in df.columns else df.year).isin(years).to_numpy()
+
+
+def get_years(df, years):
+    return df if years is None or df.empty else df[get_years_mask(df, years)]
+
+
+# Rows of df_store with nans to interpolate: the nans of the groups in df_interpolate
+def get_fill_mask(df_store, df_interpolate, cat_codes=None, store_keys=None):
+    if cat_codes is None:
+        cat_codes = df_store['cat_code'].astype('category').cat.categories
+    if store_keys is None:
+        store_keys = get_store_keys(df_store, cat_codes)
+    return store_keys.isin(get_store_keys(df_interpolate, cat_codes)) & df_store['sales'].isna().to_numpy()
+
+
+# Encode each row's (cat_code, sales_date) key as a single integer index: the cat_code's position
+# in cat_codes in the high bits and the number of months since 1970 in the low bits
+def get_store_keys(df, cat_codes):
+    code_positions = pd.Categorical(df['cat_code'], categories=cat_codes).codes.astype('int64')
+    months = df['sales_date'].to_numpy().astype('datetime64[M]').astype('int64')
+    return pd.Index((code_positions << 32) + months)
@@ -22,7 +22,7 @@ class EvalNames:
     # Currently not used
     def show_year_nans(self):
         # Split df into groups by "cat_code"
-        df_store_gk = self.df_store.groupby(self.df_store.sales_date.map(lambda x: x.year))
+        df_store_gk = self.df_store.groupby(self.df_store.sales_date.dt.year)
         # Loop through each group
         for name, group in df_store_gk:
             nans = group.sales.isna().sum()
@@ -34,7 +34,7 @@ class EvalNames:
     # Currently not used
     def show_cat_code_nans(self):
         # Split df into groups by "cat_code"
-        df_store_gk = self.df_store.groupby("cat_code")
+        df_store_gk = self.df_store.groupby("cat_code", observed=True)
         # Loop through each group
         for name, group in df_store_gk:
             nans = group.sales.isna().sum()
@@ -48,69 +48,39 @@ class EvalNames:
         # Notify user of status
         self.msg_cat_code_year_nans += "Processing: displaying category codes (NAICS) that have missing values (nans) by year"
 
-        # Split df into groups by "cat_code" then by the "sales_date" year
-        df_store_gk = self.df_store.groupby(["cat_code", self.df_store.sales_date.map(lambda x: x.year)])
+        # Count nans by "cat_code" then by the "sales_date" year in one grouped aggregation
+        is_nan = self.df_store.sales.isna()
+        nans_gk = is_nan.groupby([self.df_store.cat_code, self.df_store.sales_date.dt.year.rename("year")], observed=True)
+        nans_by_group = nans_gk.sum()
+        # The same counts broadcast back to every row of each group
+        nans_by_row = nans_gk.transform("sum")
 
-        cur_cat_code = ""
-        prev_year = None
-        is_non_consec = False
-        is_diff_cat_code = False
+        # NAICS Codes with 1-3 nans per year will be interpolated in the clean module,
+        # and those with more than 4 nans per year will be dropped from the dataset
+        is_interpolate_row = nans_by_row.between(1, 3)
+        is_drop_row = nans_by_row > 4
 
-        # Loop through each group
-        for names, df_group in df_store_gk:
-            nans = df_group.sales.isna().sum()
-            if nans in range(1,4):
-                # NAICS Codes with 1-3 nans per year
-                # which will be interpolated in the clean module
-
-                # Split the two group by keys 
-                cat_code, year = names
-                # Check if cat_code has changed
-                is_diff_cat_code = True if cur_cat_code != cat_code else False
-                # Check if nans are from consecutive year
-                is_non_consec = False if prev_year == None else True if prev_year != year - 1 else False
-                # Don't print 'nonconsecutive' for change in cat_codes 
-                if is_non_consec and not is_diff_cat_code:
-                    self.msg_cat_code_year_nans += "\n\t\t--nonconsecutive year--"
-                # Print cat_code as header
-                if is_diff_cat_code:
-                    self.msg_cat_code_year_nans += f"\n\tCat_code: {cat_code}"
-                    cur_cat_code = cat_code
-                    is_non_consec = False
-                # Print nans by year if nans are between 1-3
-                self.msg_cat_code_year_nans += f"\n\t\tYear: {year} has {nans} nans, Action: interpolate"
-                # Track previous year
-                prev_year = year
-                # Append grouped dataframe with 1 - 3 nans
-                # Use apply function to convert group to dataframe
-                self.df_nans_interpolate = self.df_nans_interpolate.append(df_group.apply(lambda x: x))
-                # Track number or records that will be interpolated
-                self.count_interpolations += nans
-            elif nans > 4:
-                # NAICS Codes with at least 4 nans per year, 
-                # which will be dropped from the dataset in the clean module
+        # Select the grouped rows with masks, ordered by cat_code then year like the groups themselves
+        self.df_nans_interpolate = self.df_store[is_interpolate_row].sort_values(["cat_code", "sales_date"], kind="mergesort")
+        self.df_nans_drop = self.df_store[is_drop_row].sort_values(["cat_code", "sales_date"], kind="mergesort")
+        # Track number or records that will be interpolated
+        self.count_interpolations = int(is_nan[is_interpolate_row].sum())
 
-                # Split the two group by keys 
-                cat_code, year = names
-                # Check if cat_code has changed
-                is_diff_cat_code = True if cur_cat_code != cat_code else False
-                # Check if nans are from consecutive year
-                is_non_consec = False if prev_year == None else True if prev_year != year - 1 else False
-                # Don't print 'nonconsecutive' for change in cat_codes 
-                if is_non_consec and not is_diff_cat_code:
-                    self.msg_cat_code_year_nans += "\n\t\t--nonconsecutive year--"
-                # Print cat_code as header
-                if is_diff_cat_code:
-                    self.msg_cat_code_year_nans += f"\n\tCat_code: {cat_code}"
-                    cur_cat_code = cat_code
-                    is_non_consec = False
-                # Print nans by year if nans are greater than 3
-                self.msg_cat_code_year_nans += f"\n\t\tYear: {year} has {nans} nans, Action: drop"
-                # Track previous year
-                prev_year = year
-                # Append grouped dataframe with more than 3 nans
-                # Use apply function to convert group to dataframe
-                self.df_nans_drop = self.df_nans_drop.append(df_group.apply(lambda x: x))
+        # Build the report from the groups that will be interpolated or dropped
+        df_groups = nans_by_group[(nans_by_group.between(1, 3)) | (nans_by_group > 4)].rename("nans").reset_index()
+        if not df_groups.empty:
+            cat_code = df_groups.cat_code.astype(str)
+            year = df_groups.year
+            action = pd.Series("drop", index=df_groups.index).where(df_groups.nans > 4, "interpolate")
+            # Print cat_code as header when it changes
+            is_diff_cat_code = cat_code != cat_code.shift()
+            # Flag nans that are not from the consecutive year (only within the same cat_code)
+            is_non_consec = (year != year.shift() + 1) & ~is_diff_cat_code
+            # One report entry per group, joined in a single step
+            msg_lines = pd.Series("", index=df_groups.index).where(~is_non_consec, "\n\t\t--nonconsecutive year--") + \
+                        ("\n\tCat_code: " + cat_code).where(is_diff_cat_code, "") + \
+                        "\n\t\tYear: " + year.astype(str) + " has " + df_groups.nans.astype(str) + " nans, Action: " + action
+            self.msg_cat_code_year_nans += "".join(msg_lines)
         self.msg_cat_code_year_nans += f"\nCompleted: displayed category codes (NAICS)" + \
                                         " that have missing values (nans) by year in" + \
                                        f" {round(perf_counter()-start_time,4)} seconds"
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+# Interpolation methods for missing store sales
+#   linear:   straight line between the nearest months with sales of the same cat_code
+#   time:     like linear, weighted by the number of days between those months
+#   seasonal: average of the same month in the prior and next year of the same cat_code
+#             (linear when neither of those months has sales)
+METHODS = ["linear", "time", "seasonal"]
+
+
+# Return df_store's sales with the rows flagged in is_fill interpolated within their own cat_code
+def interpolate_sales(df_store, is_fill, method="linear"):
+    if method not in METHODS:
+        raise ValueError(f"Interpolation method must be one of {', '.join(METHODS)}. Got {method}")
+    sales = df_store['sales'].to_numpy(dtype='float64', na_value=np.nan)
+    is_fill = np.asarray(is_fill)
+    if not is_fill.any():
+        return sales
+
+    matrix, month_pos, code_pos, first_month = get_matrix(df_store, sales)
+
+    # Only the flagged cells are computed, using their nearest months with sales in the same column
+    fill_months, fill_codes = month_pos[is_fill], code_pos[is_fill]
+    if method == "seasonal":
+        values = get_seasonal(matrix, fill_months, fill_codes)
+        # Fall back to linear when neither the prior nor the next year has sales for that month
+        is_missing = np.isnan(values)
+        values[is_missing] = get_linear(matrix, fill_months[is_missing], fill_codes[is_missing], "linear", first_month)
+    else:
+        values = get_linear(matrix, fill_months, fill_codes, method, first_month)
+    sales[is_fill] = values
+    return sales
+
+
+# First and last month (datetime64[M]) that each flagged row's interpolated value can depend on. Besides the
+# months it reads, this covers every month between them, where new sales would become its nearest months instead.
+def get_source_months(df_store, is_fill, method="linear"):
+    if method not in METHODS:
+        raise ValueError(f"Interpolation method must be one of {', '.join(METHODS)}. Got {method}")
+    sales = df_store['sales'].to_numpy(dtype='float64', na_value=np.nan)
+    matrix, month_pos, code_pos, first_month = get_matrix(df_store, sales)
+    fill_months, fill_codes = month_pos[np.asarray(is_fill)], code_pos[np.asarray(is_fill)]
+    prev_pos, next_pos, has_prev, has_next = get_neighbour_months(matrix, fill_months, fill_codes)
+    # Without a month with sales on one side, sales added anywhere on that side would be used
+    first_pos = np.where(has_prev, prev_pos, 0)
+    last_pos = np.where(has_next, next_pos, matrix.shape[0] - 1)
+    if method == "seasonal":
+        # The same month of the prior and next year, with linear as the fallback
+        first_pos = np.minimum(first_pos, fill_months - 12)
+        last_pos = np.maximum(last_pos, fill_months + 12)
+    return first_month + first_pos, first_month + last_pos
+
+
+# Place every row in a (month x cat_code) matrix, so each column is one category's time series
+def get_matrix(df_store, sales):
+    months = df_store['sales_date'].to_numpy().astype('datetime64[M]')
+    first_month = months.min()
+    month_pos = (months - first_month).astype('int64')
+    code_pos = pd.Categorical(df_store['cat_code']).codes.astype('int64')
+    matrix = np.full((month_pos.max() + 1, code_pos.max() + 1), np.nan)
+    matrix[month_pos, code_pos] = sales
+    return matrix, month_pos, code_pos, first_month
+
+
+# Previous and next month with sales for every flagged cell, found for all columns at once
+def get_neighbour_months(matrix, fill_months, fill_codes):
+    month_count = matrix.shape[0]
+    is_valid = ~np.isnan(matrix)
+    row_pos = np.arange(month_count)[:, None]
+    prev_pos = np.maximum.accumulate(np.where(is_valid, row_pos, -1), axis=0)[fill_months, fill_codes]
+    next_pos = np.minimum.accumulate(np.where(is_valid, row_pos, month_count)[::-1], axis=0)[::-1][fill_months, fill_codes]
+    return prev_pos, next_pos, prev_pos >= 0, next_pos < month_count
+
+
+def get_linear(matrix, fill_months, fill_codes, method, first_month):
+    # Position along the time axis: month number for linear, day number for time
+    month_count = matrix.shape[0]
+    if method == "time":
+        axis = (first_month + np.arange(month_count)).astype('datetime64[D]').astype('int64').astype('float64')
+    else:
+        axis = np.arange(month_count, dtype='float64')
+
+    prev_pos, next_pos, has_prev, has_next = get_neighbour_months(matrix, fill_months, fill_codes)
+
+    # Without a month on one side, use the nearest month on the other side
+    prev_pos = np.where(has_prev, prev_pos, next_pos).clip(0, month_count - 1)
+    next_pos = np.where(has_next, next_pos, prev_pos).clip(0, month_count - 1)
+    prev_value = matrix[prev_pos, fill_codes]
+    next_value = matrix[next_pos, fill_codes]
+    span = axis[next_pos] - axis[prev_pos]
+    weight = np.divide(axis[fill_months] - axis[prev_pos], span, out=np.zeros_like(span), where=span != 0)
+    return prev_value + (next_value - prev_value) * weight
+
+
+def get_seasonal(matrix, fill_months, fill_codes):
+    # Same month of the prior and next year (12 matrix rows away)
+    prior_months = fill_months - 12
+    next_months = fill_months + 12
+    prior_year = np.full(fill_months.shape, np.nan)
+    next_year = np.full(fill_months.shape, np.nan)
+    has_prior = prior_months >= 0
+    has_next = next_months < matrix.shape[0]
+    prior_year[has_prior] = matrix[prior_months[has_prior], fill_codes[has_prior]]
+    next_year[has_next] = matrix[next_months[has_next], fill_codes[has_next]]
+    # Average both years when available, otherwise use the one that is
+    return np.where(np.isnan(prior_year), next_year,
+                    np.where(np.isnan(next_year), prior_year, (prior_year + next_year) / 2))